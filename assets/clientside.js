@@ -0,0 +1,135 @@
+/*
+clientside callbacks: pure UI interactions answered in the browser, without a request to the server
+registered in macro_data_explorer_app.py with ClientsideFunction(namespace='macro_explorer', ...)
+*/
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    macro_explorer: {
+
+        // open or close a collapse section when its button is clicked
+        toggle_collapse: function(n_clicks, is_open) {
+            if (n_clicks) {
+                return !is_open;
+            }
+            return is_open;
+        },
+
+        // the custom benchmark dropdown is disabled while cluster group countries are the benchmark
+        custom_dropdown_disabled: function(selected_radio_value) {
+            return selected_radio_value === 'cluster-benchmark';
+        },
+
+        // years of the data setup range slider for the cluster year dropdowns (options, explore table options),
+        // the selected cluster year is not written, a change of it starts a clustering job
+        cluster_year_options: function(data_range_selected) {
+            const start_year = parseInt(data_range_selected[0]);
+            const end_year = parseInt(data_range_selected[1]);
+
+            const years_list_options = [];
+            for (let year = start_year; year <= end_year; year++) {
+                years_list_options.push(year);
+            }
+            return [years_list_options, years_list_options];
+        },
+
+        // animated data chart from the columnar frames (top 20 countries of every year) sent once per indicator,
+        // a zoom keeps the years of the range and the top 20 countries of its first year, as build_data_figure
+        animated_chart_figure: function(relayout_data, frames) {
+            if (!frames || !frames.layout) {
+                return window.dash_clientside.no_update;
+            }
+
+            const indicator = frames.indicator;
+            let rows = frames.Year.map((year, row) => row);
+
+            const zoomed = relayout_data != null && relayout_data['xaxis.range[0]'] !== undefined;
+            if (zoomed) {
+                const start_year = Math.trunc(relayout_data['xaxis.range[0]']);
+                const end_year = Math.trunc(relayout_data['xaxis.range[1]']);
+                rows = rows.filter(row => frames.Year[row] >= start_year && frames.Year[row] <= end_year);
+            }
+
+            // rows are sorted by year and descending value, the first row of every year is its maximum
+            let max_value = null;
+            for (const row of rows) {
+                if (max_value === null || frames.value[row] > max_value) {
+                    max_value = frames.value[row];
+                }
+            }
+
+            const unique = (values) => Array.from(new Set(values));
+            const countries_to_keep = unique(rows.map(row => frames.Country[row])).slice(0, 20);
+            if (zoomed) {
+                const keep = new Set(countries_to_keep);
+                rows = rows.filter(row => keep.has(frames.Country[row]));
+            }
+
+            // one bar trace per (country, year) as plotly express builds it: countries in order of appearance
+            // with the colors of the template
+            const countries = unique(rows.map(row => frames.Country[row]));
+            const years = unique(rows.map(row => frames.Year[row]));
+            const colorway = frames.layout.template.layout.colorway;
+
+            const groups = new Map();
+            for (const row of rows) {
+                const group_key = `${frames.Country[row]}:${frames.Year[row]}`;
+                if (!groups.has(group_key)) {
+                    groups.set(group_key, []);
+                }
+                groups.get(group_key).push(row);
+            }
+
+            const frame_data = new Map(years.map(year => [year, []]));
+            countries.forEach((country, position) => {
+                const name = frames.countries[country];
+                for (const year of years) {
+                    const group = groups.get(`${country}:${year}`);
+                    if (group === undefined) {
+                        continue;
+                    }
+                    frame_data.get(year).push({
+                        alignmentgroup: 'True',
+                        hovertemplate: `Country=%{y}<br>Year=${year}<br>${indicator}=%{x}<extra></extra>`,
+                        legendgroup: name,
+                        marker: {color: colorway[position % colorway.length], pattern: {shape: ''}},
+                        name: name,
+                        offsetgroup: name,
+                        orientation: 'h',
+                        showlegend: true,
+                        textposition: 'auto',
+                        x: group.map(row => frames.value[row]),
+                        xaxis: 'x',
+                        y: group.map(() => name),
+                        yaxis: 'y',
+                        type: 'bar',
+                    });
+                }
+            });
+
+            const layout = JSON.parse(JSON.stringify(frames.layout));
+            layout.xaxis.range = [0, max_value];
+            layout.yaxis.categoryarray = countries_to_keep.map(country => frames.countries[country]).reverse();
+
+            const figure = {data: years.length ? frame_data.get(years[0]) : [], layout: layout};
+            if (years.length > 1) {
+                const step = layout.sliders[0].steps[0];
+                layout.sliders[0].steps = years.map(year => {
+                    const year_step = JSON.parse(JSON.stringify(step));
+                    year_step.args[0] = [String(year)];
+                    year_step.label = String(year);
+                    return year_step;
+                });
+                figure.frames = years.map(year => ({data: frame_data.get(year), name: String(year)}));
+            } else {
+                // a single frame is a static figure: no slider, only the play and pause buttons of build_data_figure
+                delete layout.sliders;
+                const buttons = layout.updatemenus[0];
+                layout.updatemenus[0] = {buttons: buttons.buttons, showactive: buttons.showactive, type: buttons.type};
+            }
+            if (years.length === 0) {
+                delete layout.legend.title;
+            }
+            return figure;
+        },
+    }
+});
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark of the batch mode of the cluster analysis (every year of the range): the per-year k-means fits alone
+# vs. cluster_membership (the fits and the alignment of the groups from year to year), the share of countries which
+# keep their group from one year to the next with and without the alignment, and a switch of the cluster year
+# answered from the cache
+#
+# usage: python benchmarks/bench_cluster_batch.py [--clusters 4]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import diskcache
+import numpy as np
+
+import macro_data_explorer_app as app_module
+
+
+def stay_rate(labels):
+    # share of the countries clustered in two consecutive years which keep their group number
+    rates = []
+    for previous, current in zip(labels[:-1], labels[1:]):
+        both = (previous >= 0) & (current >= 0)
+        rates.append((previous[both] == current[both]).mean())
+    return float(np.mean(rates))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clusters', type=int, default=4)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+
+    # fits of the benchmark go to an empty cache, the cache of the app is left untouched
+    app_module.CLUSTER_CACHE = diskcache.Cache(tempfile.mkdtemp())
+    app_module.analytics_modules()  # scikit-learn is imported before the timings
+
+    # all continents, full year range
+    selection = app_module.make_selection(2000, 2020, [])
+    indicators = ['GDP growth (annual %)', 'Unemployment, total (% of total labor force) (national estimate)']
+    years = app_module.cluster_years(selection, indicators, args.clusters)
+    year_data = {year: app_module.prepare_cluster_data(selection, year, indicators) for year in years}
+
+    start = time.perf_counter()
+    raw = {year: app_module.fit_clusters(year_data[year][1], args.clusters) for year in years}
+    fits_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    membership = app_module.cluster_membership(selection, indicators, args.clusters, year_data)
+    membership_time = time.perf_counter() - start
+
+    # the raw labels of every fit in the same year x country matrix as the membership
+    country_index = {country: i for i, country in enumerate(membership['countries'])}
+    raw_labels = np.full_like(membership['labels'], -1)
+    for row, year in enumerate(years):
+        positions = [country_index[country] for country in year_data[year][0]['Country Name']]
+        raw_labels[row, positions] = raw[year]['labels']
+
+    # the first call fits every year of the range, the second one is a switch back to a fitted year
+    app_module.update_cluster_graph(lambda progress: None, 1, selection, indicators, years[-1], args.clusters, True)
+    start = time.perf_counter()
+    app_module.update_cluster_graph(lambda progress: None, 1, selection, indicators, years[-1], args.clusters, True, True)
+    switch_time = time.perf_counter() - start
+
+    print(f'{len(years)} years ({years[0]}-{years[-1]}), {len(membership["countries"])} countries, '
+          f'k = {args.clusters}')
+    print(f'{"per-year fits (s)":<24} {fits_time:8.2f}')
+    print(f'{"membership (s)":<24} {membership_time:8.2f}')
+    print(f'{"year switch (ms)":<24} {switch_time * 1000:8.1f}')
+    print(f'{"stay rate, raw labels":<24} {stay_rate(raw_labels):8.2f}')
+    print(f'{"stay rate, aligned":<24} {stay_rate(membership["labels"]):8.2f}')
+
+
+if __name__ == '__main__':
+    main()
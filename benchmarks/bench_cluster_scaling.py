@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark of the preparation of the clustering data of one year (mean imputation and standard scaling):
+# SimpleImputer + StandardScaler fitted on a slice of the wide data frame vs. prepare_cluster_data, a numpy broadcast
+# with the precomputed (year, indicator) statistics of indicator_stats
+#
+# usage: python benchmarks/bench_cluster_scaling.py [--repeat 5]
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import numpy as np
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import StandardScaler
+
+import macro_data_explorer_app as app_module
+
+
+def sklearn_prepare(df_transformed, year, indicators):
+    # the preparation of one year as update_cluster_graph did it before, on the wide data frame of the selection
+    filtered_df = df_transformed.loc[(df_transformed['year'] == year)].copy()
+    filtered_df[indicators] = SimpleImputer(missing_values=np.nan, strategy='mean').fit_transform(filtered_df[indicators])
+    return filtered_df, StandardScaler().fit_transform(filtered_df[indicators])
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+
+    indicators = ['GDP growth (annual %)', 'Unemployment, total (% of total labor force) (national estimate)',
+                  'Inflation, consumer prices (annual %)', 'Gross domestic savings (% of GDP)']
+
+    print(f'{"continents":<18} {"years":>6} {"sklearn (ms)":>13} {"numpy (ms)":>11} {"max abs diff":>13}')
+    for continents in [[], ['Africa', 'Europe'], ['Asia']]:
+        selection = app_module.make_selection(2000, 2020, continents)
+        years = app_module.cluster_years(selection, indicators, 1)
+
+        # both preparations give the same countries, imputed values and scaled data in every year
+        max_diff = 0.0
+        df_transformed = app_module.PANEL.wide(selection)
+        for year in years:
+            filtered_df, scaled = sklearn_prepare(df_transformed, year, indicators)
+            df_year, scaled_data, _ = app_module.prepare_cluster_data(selection, year, indicators)
+            assert filtered_df['Country Name'].tolist() == df_year['Country Name'].tolist()
+            np.testing.assert_allclose(df_year[indicators].to_numpy(), filtered_df[indicators].to_numpy(), rtol=1e-9)
+            max_diff = max(max_diff, float(np.abs(scaled_data - scaled).max()))
+        assert max_diff < 1e-9
+
+        def sklearn_years():
+            df_transformed = app_module.PANEL.wide(selection)
+            return [sklearn_prepare(df_transformed, year, indicators) for year in years]
+
+        sklearn_time = best_of(sklearn_years, args.repeat)
+        numpy_time = best_of(lambda: [app_module.prepare_cluster_data(selection, year, indicators) for year in years],
+                             args.repeat)
+        print(f'{"+".join(continents) or "all":<18} {len(years):>6} {sklearn_time * 1000:13.1f} '
+              f'{numpy_time * 1000:11.1f} {max_diff:13.1e}')
+
+    print(f'(all years of 2000-2020 with {len(indicators)} indicators, best of {args.repeat} runs)')
+
+
+if __name__ == '__main__':
+    main()
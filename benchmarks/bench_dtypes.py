@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Memory and filter latency of the dataset with the original dtypes (python strings, int64 years)
+# vs. the compact dtypes used by the app (categoricals, int16 years)
+#
+# usage: python benchmarks/bench_dtypes.py [--repeat 20]
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import macro_data_explorer_app as app_module
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    frames = {'original': app_module.load_macro_data(compact=False),
+              'compact': app_module.load_macro_data(compact=True),
+              'compact float32': app_module.compact_dtypes(app_module.load_macro_data(compact=False), 'float32')}
+
+    print('== memory (deep)')
+    for name, df in frames.items():
+        print(f'{name:>16}: {df.memory_usage(deep=True).sum() / 2**20:8.2f} MB')
+    print()
+
+    indicator = 'Population, total'
+    continents = ['Africa', 'Europe']
+    filters = {
+        "Series Name == indicator": lambda df: df[df['Series Name'] == indicator],
+        "Continent.isin(continents)": lambda df: df[df['Continent'].isin(continents)],
+        "year.between(2005, 2015)": lambda df: df[df['year'].between(2005, 2015)],
+    }
+
+    print(f'== filter latency (best of {args.repeat}, ms)')
+    print(f'{"filter":>30} {"original":>10} {"compact":>10}')
+    for name, func in filters.items():
+        original = best_of(lambda: func(frames['original']), args.repeat)
+        compact = best_of(lambda: func(frames['compact']), args.repeat)
+        print(f'{name:>30} {original * 1000:10.2f} {compact * 1000:10.2f}')
+
+    # filtering directly on the integer codes of the categorical
+    df = frames['compact']
+    code = df['Series Name'].cat.categories.get_loc(indicator)
+    codes = df['Series Name'].cat.codes.to_numpy()
+    compact = best_of(lambda: df[codes == code], args.repeat)
+    print(f'{"Series Name codes == code":>30} {"":>10} {compact * 1000:10.2f}')
+
+
+if __name__ == '__main__':
+    main()
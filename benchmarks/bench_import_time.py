@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Cold-start report of the app module (python -X importtime breakdown)
+#
+# Imports the app in a fresh interpreter, once as a worker does at start and once followed by
+# the deferred analytics imports (plotly express, scikit-learn) of the first figure / clustering call.
+#
+# usage: python benchmarks/bench_import_time.py [--top 25]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# function used in running a statement with -X importtime in a fresh interpreter
+def import_time(statement):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    wall_time = time.perf_counter() - start
+
+    # lines look like: "import time:  self [us] | cumulative | imported package"
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.rstrip()[1:], int(self_us), int(cumulative_us)))  # nested imports keep their indent
+    return wall_time, modules
+
+
+def print_report(title, wall_time, modules, top):
+    top_level = [m for m in modules if not m[0].startswith(' ')]
+    total_us = sum(m[2] for m in top_level)
+
+    # packages imported directly (depth 0) or by the app module and other top level imports (depth 1)
+    shallow = [m for m in modules if not m[0].startswith('   ')]
+    print(f'== {title}')
+    print(f'wall time: {wall_time:.2f} s, imports: {total_us / 1e6:.2f} s, modules: {len(modules)}')
+    print(f'{"cumulative (ms)":>16} {"self (ms)":>10}  package')
+    for name, self_us, cumulative_us in sorted(shallow, key=lambda m: -m[2])[:top]:
+        print(f'{cumulative_us / 1000:16.1f} {self_us / 1000:10.1f}  {name.strip()}')
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    wall_time, modules = import_time('import macro_data_explorer_app')
+    print_report('worker start (import macro_data_explorer_app)', wall_time, modules, args.top)
+
+    wall_time, modules = import_time('import macro_data_explorer_app as m; m.analytics_modules()')
+    print_report('worker start + first figure / clustering call', wall_time, modules, args.top)
+
+
+if __name__ == '__main__':
+    main()
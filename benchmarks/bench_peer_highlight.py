@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark of the highlighted countries of the peer map: apply with list membership over every country-year row
+# of the panel of a clustering run vs. one row per country and an isin mask, for growing custom benchmark selections
+#
+# usage: python benchmarks/bench_peer_highlight.py [--repeat 5]
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import numpy as np
+
+import macro_data_explorer_app as app_module
+
+
+def apply_highlight(df, selected_country, selected_custom_benchmark):
+    df_filter = df.copy()
+    selected_countries = list(selected_custom_benchmark) + [selected_country]
+    return df_filter['Country Name'].apply(lambda country: 7 if country in selected_countries else 1).tolist()
+
+
+def isin_highlight(df, selected_country, selected_custom_benchmark):
+    df_countries = df.drop_duplicates('Country Name')
+    selected_countries = list(selected_custom_benchmark) + [selected_country]
+    return np.where(df_countries['Country Name'].isin(selected_countries), 7, 1).tolist()
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def cluster_store():
+    # cluster store of two cluster groups over all continents and years
+    selection = app_module.make_selection(2000, 2021, [])
+    indicators = ['GDP growth (annual %)', 'Inflation, consumer prices (annual %)']
+    outputs = app_module.update_cluster_graph(lambda progress: None, 1, selection, indicators, 2010, 2)
+    return outputs[5]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+
+    stored_cluster_data = cluster_store()
+    countries = app_module.peer_catalog(stored_cluster_data)['countries']
+    country = countries[0]
+    df, _ = app_module.cluster_panel(stored_cluster_data)
+    print(f'panel of the clustering run: {len(df)} rows, {len(countries)} countries')
+
+    print(f'{"selected":>9} {"apply (ms)":>11} {"isin (ms)":>10} {"callback (ms)":>14} {"patch (ms)":>11}')
+    for n_selected in [1, 10, 50, len(countries) - 1]:
+        custom_benchmark = countries[1:n_selected + 1]
+
+        # the two highlights agree on every country
+        per_row = dict(zip(df['Country Name'], apply_highlight(df, country, custom_benchmark)))
+        per_country = dict(zip(df['Country Name'].unique(), isin_highlight(df, country, custom_benchmark)))
+        assert per_row == per_country
+
+        apply_time = best_of(lambda: apply_highlight(df, country, custom_benchmark), args.repeat)
+        isin_time = best_of(lambda: isin_highlight(df, country, custom_benchmark), args.repeat)
+
+        # the whole callback: full figure (base map from the cache) and colour-only patch
+        _, peer_key = app_module.update_peer_choropleth_graph(country, 'custom-benchmark', stored_cluster_data,
+                                                              custom_benchmark, None)
+        callback_time = best_of(lambda: app_module.update_peer_choropleth_graph(
+            country, 'custom-benchmark', stored_cluster_data, custom_benchmark, None), args.repeat)
+        patch_time = best_of(lambda: app_module.update_peer_choropleth_graph(
+            country, 'custom-benchmark', stored_cluster_data, custom_benchmark, None, peer_key), args.repeat)
+
+        print(f'{n_selected:>9} {apply_time * 1000:11.1f} {isin_time * 1000:10.1f} '
+              f'{callback_time * 1000:14.1f} {patch_time * 1000:11.1f}')
+
+    print(f'(best of {args.repeat} runs, highlights on the panel of the run, callbacks read the country -> cluster mapping of the store)')
+
+
+if __name__ == '__main__':
+    main()
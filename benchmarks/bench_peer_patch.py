@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Payload and callback time of the common edits of the peer comparison chart (adding or removing a custom
+# benchmark country, changing the indicator): the full figure vs. the Patch sent by update_peer_graph
+#
+# usage: python benchmarks/bench_peer_patch.py [--repeat 5]
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from plotly.io.json import to_json_plotly
+
+import macro_data_explorer_app as app_module
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+def cluster_store():
+    # cluster store of a clustering over all continents, the peer callbacks read the panel of its run
+    selection = app_module.make_selection(2000, 2020, [])
+    indicators = ['GDP growth (annual %)', 'Unemployment, total (% of total labor force) (national estimate)']
+    outputs = app_module.update_cluster_graph(lambda progress: None, 1, selection, indicators, 2010, 4)
+    return outputs[5]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+
+    stored_cluster_data = cluster_store()
+    countries = app_module.peer_catalog(stored_cluster_data)['countries']
+    country = countries[0]
+    indicator = 'GDP (current US$)'
+    other_indicator = 'Inflation, consumer prices (annual %)'
+
+    # (edit, custom benchmark before, custom benchmark after, indicator after)
+    edits = [
+        ('add a country', countries[1:6], countries[1:7], indicator),
+        ('remove a country', countries[1:7], countries[1:6], indicator),
+        ('change the indicator', countries[1:6], countries[1:6], other_indicator),
+    ]
+
+    print(f'{"graph":<6} {"edit":<22} {"full (kB)":>10} {"full (ms)":>10} {"patch (kB)":>11} {"patch (ms)":>11}')
+    for graph_type in ['line', 'heat']:
+        for edit, before, after, after_indicator in edits:
+            _, state = app_module.update_peer_graph(1, stored_cluster_data, country, 'custom-benchmark', list(before),
+                                                    indicator, graph_type)
+
+            def update(previous_state):
+                return app_module.update_peer_graph(1, stored_cluster_data, country, 'custom-benchmark', list(after),
+                                                    after_indicator, graph_type, previous_state)[0]
+
+            full, full_time = best_of(lambda: to_json_plotly(update(None)), args.repeat)
+            patch, patch_time = best_of(lambda: to_json_plotly(update(state)), args.repeat)
+
+            print(f'{graph_type:<6} {edit:<22} {len(full) / 1e3:10.1f} {full_time * 1000:10.1f} '
+                  f'{len(patch) / 1e3:11.1f} {patch_time * 1000:11.1f}')
+
+    df_panel, _ = app_module.cluster_panel(stored_cluster_data)
+    print(f'({len(df_panel)} panel rows, callback time includes serialization, best of {args.repeat} runs)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Startup benchmark: parsing the excel file vs. loading the columnar .npy cache
+#
+# usage: python benchmarks/bench_startup.py [--repeat 5]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pandas as pd
+
+import macro_data_explorer_app as app_module
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    source = app_module.DATA_PATH
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        excel_time, df_excel = best_of(lambda: pd.read_excel(source), max(1, args.repeat // 2))
+
+        start = time.perf_counter()
+        app_module.load_macro_data(source, cache_dir=cache_dir)
+        cold_time = time.perf_counter() - start
+
+        warm_time, df_cache = best_of(lambda: app_module.load_macro_data(source, cache_dir=cache_dir), args.repeat)
+
+    pd.testing.assert_frame_equal(app_module.compact_dtypes(df_excel), df_cache)
+
+    print(f'rows: {len(df_excel):,}')
+    print(f'pd.read_excel:             {excel_time * 1000:9.1f} ms')
+    print(f'cold start (parse + cache):{cold_time * 1000:9.1f} ms')
+    print(f'warm start (.npy cache):   {warm_time * 1000:9.1f} ms')
+    print(f'speed-up:                  {excel_time / warm_time:9.1f} x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Payload size, encode time and read time of the cluster store as the app sends it (cluster group per country,
+# centroids and the settings of the run): frames as to_dict('records') vs. the column-oriented encode_frame,
+# read back as the country -> cluster mapping used by the peer callbacks
+#
+# usage: python benchmarks/bench_store_encoding.py [--repeat 5]
+
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pandas as pd
+from plotly.io.json import to_json_plotly
+
+import macro_data_explorer_app as app_module
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def records_labels(stored_cluster_data):
+    # country -> cluster mapping of a store holding records, as cluster_labels reads the columnar store
+    records = stored_cluster_data['labels']
+    return pd.Series([record['Cluster'] for record in records], dtype=object, name='Cluster',
+                     index=pd.Index([record['Country Name'] for record in records], name='Country Name'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+
+    # cluster store of a clustering over all continents, as update_cluster_graph produces it
+    selection = app_module.make_selection(2000, 2021, [])
+    indicators = ['GDP growth (annual %)', 'Inflation, consumer prices (annual %)']
+    outputs = app_module.update_cluster_graph(lambda progress: None, 1, selection, indicators, 2010, 4)
+    stored_cluster_data = outputs[5]
+    run = stored_cluster_data['run']
+
+    # frames of the store, rebuilt from its columns
+    frames = {name: pd.DataFrame(dict(zip(stored_cluster_data[name]['columns'], stored_cluster_data[name]['data'])))
+              for name in ['labels', 'centroids']}
+
+    formats = {'records': (lambda: {**{name: frame.to_dict('records') for name, frame in frames.items()}, 'run': run},
+                           records_labels),
+               'columnar': (lambda: {**{name: app_module.encode_frame(frame) for name, frame in frames.items()}, 'run': run},
+                            app_module.cluster_labels)}
+
+    print(f'{"format":<9} {"labels (kB)":>12} {"centroids (kB)":>15} {"store (kB)":>11} {"encode (ms)":>12} {"read (ms)":>10}')
+    expected = app_module.cluster_labels(stored_cluster_data)
+    for format_name, (encode, read) in formats.items():
+        # the browser round trip: serialized by dash, parsed as json on the next request
+        store = encode()
+        payload = to_json_plotly(store)
+        parsed = json.loads(payload)
+        pd.testing.assert_series_equal(read(parsed), expected)
+
+        encode_time = best_of(lambda: to_json_plotly(encode()), args.repeat)
+        read_time = best_of(lambda: read(json.loads(payload)), args.repeat)
+        print(f'{format_name:<9} {len(to_json_plotly(store["labels"])) / 1e3:12.1f} '
+              f'{len(to_json_plotly(store["centroids"])) / 1e3:15.1f} {len(payload) / 1e3:11.1f} '
+              f'{encode_time * 1000:12.2f} {read_time * 1000:10.2f}')
+
+    print(f'({len(frames["labels"])} countries, {len(frames["centroids"])} clusters, best of {args.repeat} runs, '
+          f'encode includes json serialization, read includes json parsing)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmark of the top-N-per-year selection used by the animated bar chart:
+# groupby('Year').apply(nlargest) vs. the single sort + cumcount in top_n_per_year
+#
+# usage: python benchmarks/bench_top_n.py [--repeat 5]
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pandas as pd
+
+import macro_data_explorer_app as app_module
+
+
+def apply_top_n(data_frame, variable, n):
+    return data_frame.groupby('Year').apply(lambda group: group.nlargest(n, variable)).reset_index(drop=True)
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')  # groupby.apply deprecation warnings of newer pandas versions
+
+    # all continents, full year range
+    selection = app_module.make_selection(2000, 2020, [])
+    frames = {indicator: app_module.PANEL.indicator_frame(selection, indicator)
+              for indicator in app_module.PANEL.indicators}
+
+    print(f'{"N":>4} {"apply (ms)":>12} {"vectorized (ms)":>16} {"speed-up":>9}')
+    for n in [10, 20, 50]:
+        apply_time = 0.0
+        vectorized_time = 0.0
+        for indicator, frame in frames.items():
+            pd.testing.assert_frame_equal(apply_top_n(frame, indicator, n),
+                                          app_module.top_n_per_year(frame, indicator, n))
+            apply_time += best_of(lambda: apply_top_n(frame, indicator, n), args.repeat)
+            vectorized_time += best_of(lambda: app_module.top_n_per_year(frame, indicator, n), args.repeat)
+
+        print(f'{n:>4} {apply_time * 1000:12.1f} {vectorized_time * 1000:16.1f} {apply_time / vectorized_time:8.1f}x')
+
+    print(f'(summed over {len(frames)} indicators, best of {args.repeat} runs each)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Payload and server time of the animated data chart: a full figure built on the server for the first view and
+# every zoom vs. the columnar frames sent once per indicator and zoomed in the browser (assets/clientside.js)
+#
+# usage: python benchmarks/bench_zoom_payload.py [--zooms 5]
+
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import macro_data_explorer_app as app_module
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--zooms', type=int, default=5)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+
+    selection = app_module.make_selection(2000, 2020, [])
+    zooms = [(2000 + i, 2010 + i) for i in range(args.zooms)]
+
+    print(f'{"indicator":<45} {"server (kB)":>12} {"server (s)":>11} {"frames (kB)":>12} {"frames (s)":>11}')
+    totals = [0, 0.0, 0, 0.0]
+    for indicator in app_module.PANEL.indicators:
+        app_module.FIGURE_CACHE.clear()
+
+        # server side: one figure for the first view and one per zoom
+        server_bytes = 0
+        server_time = 0.0
+        for x_range in [None] + zooms:
+            figure, seconds = timed(lambda: app_module.build_data_figure(selection, indicator, x_range).to_json())
+            server_bytes += len(figure)
+            server_time += seconds
+
+        # clientside zoom: a single request for the frames, zooms are answered in the browser
+        frames, frames_time = timed(lambda: json.dumps(app_module.build_data_frames(selection, indicator)))
+
+        print(f'{indicator[:45]:<45} {server_bytes / 1e3:12.0f} {server_time:11.2f} '
+              f'{len(frames) / 1e3:12.0f} {frames_time:11.2f}')
+        for position, value in enumerate([server_bytes, server_time, len(frames), frames_time]):
+            totals[position] += value
+
+    print(f'{"total":<45} {totals[0] / 1e3:12.0f} {totals[1]:11.2f} {totals[2] / 1e3:12.0f} {totals[3]:11.2f}')
+    print(f'(first view and {args.zooms} zooms per indicator, requests: {1 + args.zooms} vs. 1)')
+
+
+if __name__ == '__main__':
+    main()
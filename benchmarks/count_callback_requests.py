@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Count of the HTTP requests to the Dash server (POST /_dash-update-component) in a typical session,
+# with the pure UI callbacks running clientside (assets/clientside.js) vs. all callbacks on the server
+#
+# the session is simulated on the callback graph of the app: a user event changes a property, every
+# callback with that property as Input fires, and the outputs it sets trigger the next callbacks in the chain
+#
+# usage: python benchmarks/count_callback_requests.py
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import macro_data_explorer_app as app_module
+
+
+# (description, changed properties) of a typical session, in order
+SESSION = [
+    ('open data setup', ['data-setup-collapse-button.n_clicks']),
+    ('move the year range slider', ['data-setup-range-slider.value']),
+    ('move the year range slider', ['data-setup-range-slider.value']),
+    ('submit the data setup', ['submit-data-range-button.n_clicks']),
+    ('close data setup', ['data-setup-collapse-button.n_clicks']),
+    ('change the chart indicator', ['data-chart-variable-dropdown.value']),
+    ('zoom the chart', ['animated-data-chart.relayoutData']),
+    ('open cluster analysis', ['cluster-analysis-collapse-button.n_clicks']),
+    ('submit the cluster settings', ['submit-cluster-settings-button.n_clicks']),
+    ('explore a cluster group', ['cluster-group-dropdown.value']),
+    ('change the explore year', ['cluster-group-year-dropdown.value']),
+    ('close cluster analysis', ['cluster-analysis-collapse-button.n_clicks']),
+    ('open peer analysis', ['peer-analysis-collapse-button.n_clicks']),
+    ('switch to custom benchmark', ['benchmark-selected-radio.value']),
+    ('pick custom benchmark countries', ['custom-benchmark-dropdown.value']),
+    ('switch to cluster benchmark', ['benchmark-selected-radio.value']),
+    ('submit the peer settings', ['peer-settings-submit-button.n_clicks']),
+    ('close peer analysis', ['peer-analysis-collapse-button.n_clicks']),
+]
+
+
+def callback_graph():
+    callbacks = []
+    for callback in app_module.app._callback_list:
+        # multi output callbacks are listed as '..id.prop...id.prop..'
+        outputs = [output for output in callback['output'].strip('.').split('...')]
+        inputs = [f"{item['id']}.{item['property']}" for item in callback['inputs']]
+        callbacks.append({
+            'outputs': outputs,
+            'inputs': inputs,
+            'clientside': callback.get('clientside_function') is not None,
+            'prevent_initial_call': callback.get('prevent_initial_call', False),
+        })
+    return callbacks
+
+
+def fire(callbacks, changed):
+    # callbacks fired by a set of changed properties and, in turn, by the outputs they set
+    # a callback is one request per event, also when several of its inputs change or its outputs are its own inputs
+    fired = []
+    while changed:
+        triggered = [callback for callback in callbacks
+                     if set(callback['inputs']) & changed and not any(callback is other for other in fired)]
+        fired.extend(triggered)
+        changed = {output for callback in triggered for output in callback['outputs']}
+    return fired
+
+
+def main():
+    callbacks = callback_graph()
+
+    # page load: every callback without prevent_initial_call fires once
+    initial = [callback for callback in callbacks if not callback['prevent_initial_call']]
+    events = [('page load', initial)] + [(description, fire(callbacks, set(changed))) for description, changed in SESSION]
+
+    print(f'{"event":<34} {"all server":>11} {"clientside":>11}')
+    total_server = 0
+    total_clientside = 0
+    for description, fired in events:
+        server = len(fired)
+        clientside = sum(1 for callback in fired if not callback['clientside'])
+        total_server += server
+        total_clientside += clientside
+        print(f'{description:<34} {server:>11} {clientside:>11}')
+
+    print(f'{"total requests":<34} {total_server:>11} {total_clientside:>11}')
+    print(f'{total_server - total_clientside} of {total_server} requests '
+          f'({(total_server - total_clientside) / total_server:.0%}) answered in the browser')
+
+
+if __name__ == '__main__':
+    main()
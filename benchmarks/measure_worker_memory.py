@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Memory per gunicorn worker, with and without preloading the app in the master (gunicorn.conf.py)
+#
+# Starts gunicorn in both modes, sends a few requests so that the workers touch the data, then reports
+# RSS, PSS and USS (private memory) of every worker. Shared copy-on-write pages show up as RSS - USS.
+#
+# usage: python benchmarks/measure_worker_memory.py [--workers 4] [--requests 20]
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import psutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(port, workers, timeout=180):
+    # every worker answers /metrics with its pid once it has booted
+    pids = set()
+    deadline = time.time() + timeout
+    while time.time() < deadline and len(pids) < workers:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=30) as response:
+                pids.add(json.load(response)['pid'])
+        except OSError:
+            time.sleep(0.5)
+    return pids
+
+
+def touch_data(port, requests):
+    # load the layout (dropdown options read the dataset) on every worker
+    for _ in range(requests):
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/_dash-layout', timeout=60) as response:
+            response.read()
+
+
+def measure(preload, workers, requests):
+    port = free_port()
+    env = dict(os.environ, GUNICORN_PRELOAD='1' if preload else '0', WEB_CONCURRENCY=str(workers), PORT=str(port))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'macro_data_explorer_app:server'],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(port, workers)
+        touch_data(port, requests)
+        time.sleep(1)
+
+        master = psutil.Process(process.pid)
+        rows = []
+        for proc in [master] + master.children():
+            info = proc.memory_full_info()
+            rows.append(('master' if proc.pid == master.pid else 'worker', proc.pid, info.rss, info.pss, info.uss))
+        return rows
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+
+    mb = 2 ** 20
+    for preload in [False, True]:
+        rows = measure(preload, args.workers, args.requests)
+        print(f'== preload_app = {preload}')
+        print(f'{"process":>8} {"pid":>8} {"RSS (MB)":>10} {"PSS (MB)":>10} {"USS (MB)":>10}')
+        for role, pid, rss, pss, uss in rows:
+            print(f'{role:>8} {pid:>8} {rss / mb:10.1f} {pss / mb:10.1f} {uss / mb:10.1f}')
+        total_pss = sum(row[3] for row in rows)
+        worker_uss = [row[4] for row in rows if row[0] == 'worker']
+        print(f'total PSS: {total_pss / mb:.1f} MB, mean private memory per worker: {sum(worker_uss) / len(worker_uss) / mb:.1f} MB')
+        print()
+
+
+if __name__ == '__main__':
+    main()
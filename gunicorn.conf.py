@@ -0,0 +1,29 @@
+# gunicorn configuration of the macro data explorer
+#
+# usage: gunicorn macro_data_explorer_app:server   (this file is picked up from the working directory)
+#
+# In preload mode the app module (dataset, wide panel with its continent index, analytics packages) is loaded once 
+# in the master process and the workers are forked from it, sharing those memory pages copy-on-write instead of 
+# each loading its own copy. Set GUNICORN_PRELOAD=0 to load the app in every worker instead.
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+
+timeout = 120
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+
+def when_ready(server):
+    if preload_app:
+        import macro_data_explorer_app
+        macro_data_explorer_app.preload()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import macro_data_explorer_app
+        macro_data_explorer_app.after_fork()
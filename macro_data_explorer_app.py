@@ -15,14 +15,19 @@
 # In[1]:
 
 
-from jupyter_dash import JupyterDash
 from dash import Dash
 from dash import dcc
 from dash import html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Output, Input, State
-from dash.exceptions import PreventUpdate
+from dash.dependencies import Output, Input, State, ClientsideFunction
+from dash.exceptions import PreventUpdate, MissingCallbackContextException
 from dash import dash_table
+from dash import DiskcacheManager
+from dash import Patch
+from dash import no_update
+from dash import ctx
+import diskcache
+from flask import jsonify
 
 
 # ##### 1.1 packages for data analysis
@@ -30,8 +35,25 @@ from dash import dash_table
 # In[2]:
 
 
+import os
+import gc
+import json
+import hashlib
+import tempfile
+import shutil
+import threading
+import zipfile
+import importlib.util
+from collections import OrderedDict
+from functools import lru_cache
+from types import SimpleNamespace
+
 import pandas as pd
 import numpy as np
+import xlsxwriter
+
+# parquet export needs pyarrow (optional)
+PARQUET_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
 
 
 # ##### 1.2 import packages for data visualization
@@ -39,9 +61,7 @@ import numpy as np
 # In[3]:
 
 
-import plotly
-import plotly.express as px
-import plotly.graph_objects as go
+import plotly.graph_objects as go  # graph objects are loaded lazily by plotly itself
 
 
 # ##### 1.3 import for clustering analysis
@@ -49,11 +69,18 @@ import plotly.graph_objects as go
 # In[4]:
 
 
-
-from sklearn.impute import SimpleImputer
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-import sklearn
+# plotly express and scikit-learn take most of the import time of the app, they are imported on the first figure 
+# or clustering call instead of at worker start. both are loaded together so that background clustering jobs 
+# forked from a worker which already drew a figure do not import scikit-learn again
+@lru_cache(maxsize=None)
+def analytics_modules():
+    import plotly.express as px
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import silhouette_score
+    from scipy.optimize import linear_sum_assignment
+    
+    return SimpleNamespace(px=px, KMeans=KMeans, silhouette_score=silhouette_score, 
+                           linear_sum_assignment=linear_sum_assignment)
 
 
 # ##### 1.4 import lotties extensions and sources
@@ -76,12 +103,472 @@ lotties_options = dict(loop=True, autoplay=True, rendererSettings=dict(preserveA
 # In[6]:
 
 
-DF = pd.read_excel('data/macro_data_melted_df2.xlsx')
+DATA_PATH = 'data/macro_data_melted_df2.xlsx'
+
+# binary cache of the excel file (one .npy file per column), rebuilt whenever the excel file changes
+CACHE_DIR = 'data/.cache'
+
+CACHE_FORMAT_VERSION = 2
+
 
+# function used in hashing the source file of the dataset cache
+def hash_file(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# function used in locating the manifest of the dataset cache
+def cache_manifest_path(source_path, cache_dir=CACHE_DIR):
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(cache_dir, f'{stem}.json')
+
+
+# function used in writing a data frame to the cache as one .npy file per column, numeric columns keep their dtype
+# text columns are stored as integer codes (-1 for missing) plus a fixed width unicode array of categories,
+# categoricals with the codes and categories they already have
+def write_column_cache(data_frame, source_path, source_hash, cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+
+    # build into a temporary folder first, so that workers booting at the same time never see a half written cache
+    tmp_dir = tempfile.mkdtemp(prefix=f'.{stem}-', dir=cache_dir)
+    columns = []
+    for i, col in enumerate(data_frame.columns):
+        series = data_frame[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes, categories = series.cat.codes.to_numpy(), series.cat.categories
+        elif not pd.api.types.is_numeric_dtype(series):
+            codes, categories = pd.factorize(series, sort=True)
+            codes = codes.astype(np.int32)
+        else:
+            np.save(os.path.join(tmp_dir, f'{i}.npy'), series.to_numpy())
+            columns.append({'name': col, 'kind': 'numeric', 'dtype': str(series.dtype)})
+            continue
+        np.save(os.path.join(tmp_dir, f'{i}.codes.npy'), codes)
+        np.save(os.path.join(tmp_dir, f'{i}.categories.npy'), np.asarray(categories, dtype=str))
+        columns.append({'name': col, 'kind': 'text', 'dtype': str(codes.dtype)})
+
+    # one folder per source file and dtypes, a cache with other dtypes is built next to it instead of over it
+    dtypes_key = hashlib.sha1(json.dumps([column['dtype'] for column in columns]).encode()).hexdigest()[:8]
+    data_dir = os.path.join(cache_dir, f'{stem}-{source_hash[:16]}-{dtypes_key}')
+    if os.path.isdir(data_dir):
+        shutil.rmtree(tmp_dir)
+    else:
+        os.rename(tmp_dir, data_dir)
+
+    stat = os.stat(source_path)
+    manifest = {'version': CACHE_FORMAT_VERSION,
+                'source': os.path.basename(source_path),
+                'sha256': source_hash,
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'data_dir': os.path.basename(data_dir),
+                'n_rows': len(data_frame),
+                'columns': columns}
+
+    manifest_path = cache_manifest_path(source_path, cache_dir)
+    fd, tmp_manifest = tempfile.mkstemp(prefix=f'.{stem}-', suffix='.json', dir=cache_dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_manifest, manifest_path)
+
+    # remove cache folders of older versions of the source file
+    for entry in os.listdir(cache_dir):
+        entry_path = os.path.join(cache_dir, entry)
+        if entry.startswith(f'{stem}-') and os.path.isdir(entry_path) and entry_path != data_dir:
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+    return manifest
+
+
+# function used in reading a valid cache manifest (None if the cache is missing or stale)
+def read_cache_manifest(source_path, cache_dir=CACHE_DIR):
+    manifest_path = cache_manifest_path(source_path, cache_dir)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('version') != CACHE_FORMAT_VERSION:
+        return None
+
+    if not os.path.isdir(os.path.join(cache_dir, manifest['data_dir'])):
+        return None
+
+    stat = os.stat(source_path)
+    if manifest['mtime_ns'] == stat.st_mtime_ns and manifest['size'] == stat.st_size:
+        return manifest
+
+    # mtime changed (e.g. fresh checkout): only rebuild when the content changed as well
+    if hash_file(source_path) != manifest['sha256']:
+        return None
+
+    manifest['mtime_ns'] = stat.st_mtime_ns
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# function used in loading the data frame from the cache, numeric columns and codes are memory mapped
+# and used as they are (no dtype conversion, no copy into the data frame, plain ndarray views of the maps)
+def read_column_cache(manifest, cache_dir=CACHE_DIR):
+    data_dir = os.path.join(cache_dir, manifest['data_dir'])
+    data = {}
+    for i, column in enumerate(manifest['columns']):
+        if column['kind'] == 'numeric':
+            data[column['name']] = np.load(os.path.join(data_dir, f'{i}.npy'), mmap_mode='r').view(np.ndarray)
+        else:
+            codes = np.load(os.path.join(data_dir, f'{i}.codes.npy'), mmap_mode='r').view(np.ndarray)
+            categories = np.load(os.path.join(data_dir, f'{i}.categories.npy'))
+            data[column['name']] = pd.Categorical.from_codes(codes, categories=categories, validate=False)
+    return pd.DataFrame(data, copy=False)
+
+
+# text columns of the dataset are held as pandas categoricals (integer codes plus one lookup table per column)
+CATEGORICAL_COLUMNS = ['Country Name', 'Country Code', 'Series Name', 'Series Code', 'Capital', 'Continent']
+
+# dtype of the value column: float64 (default) or float32 to halve its memory
+VALUE_DTYPE = os.environ.get('MACRO_EXPLORER_VALUE_DTYPE', 'float64')
+
+
+# function used in converting the data frame to compact dtypes: categoricals, int16 years and VALUE_DTYPE values
+def compact_dtypes(data_frame, value_dtype=VALUE_DTYPE):
+    data_frame = data_frame.copy()
+    for col in CATEGORICAL_COLUMNS:
+        data_frame[col] = data_frame[col].astype('category')
+    data_frame['year'] = data_frame['year'].astype(np.int16)
+    data_frame['value'] = data_frame['value'].astype(value_dtype)
+    return data_frame
+
+
+# function used in loading the pre-processed data: excel file is only parsed when the cache is missing or stale
+# the cache holds the compact dtypes, converted once when it is built and then memory mapped as they are
+def load_macro_data(source_path=DATA_PATH, cache_dir=CACHE_DIR, use_cache=True, compact=True):
+    if not use_cache:
+        data_frame = pd.read_excel(source_path)
+        return compact_dtypes(data_frame) if compact else data_frame
+
+    manifest = read_cache_manifest(source_path, cache_dir)
+    
+    # a cache built with another value dtype (MACRO_EXPLORER_VALUE_DTYPE) is rebuilt
+    if manifest is not None and {column['name']: column['dtype'] for column in manifest['columns']}.get('value') != VALUE_DTYPE:
+        manifest = None
+    
+    if manifest is None:
+        data_frame = compact_dtypes(pd.read_excel(source_path))
+        try:
+            write_column_cache(data_frame, source_path, hash_file(source_path), cache_dir)
+        except OSError as e:
+            print(f'could not write dataset cache: {e}')
+    else:
+        data_frame = read_column_cache(manifest, cache_dir)
+
+    if compact:
+        return data_frame
+    
+    # original dtypes of the excel file: python strings, int64 years, float64 values
+    return data_frame.astype({**{col: object for col in CATEGORICAL_COLUMNS}, 'year': np.int64, 'value': np.float64})
+
+
+DF = load_macro_data()
+
+
+# ##### 1.6 in-memory cache and selection of each user
+
+# In[ ]:
+
+
+# small thread safe least-recently-used cache, counts hits, misses and evictions
+class LRUCache:
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {'size': len(self._data),
+                    'maxsize': self.maxsize,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_ratio': self.hits / requests if requests else None}
+
+    def __len__(self):
+        return len(self._data)
+
+
+# function used in creating the selection held by the stored-data component
+def make_selection(start_year=None, end_year=None, continents=None):
+    years = None if start_year is None else [int(start_year), int(end_year)]
+    continents = sorted(continents or [])
+    key = hashlib.sha1(json.dumps([years, continents]).encode()).hexdigest()[:16]
+    return {'years': years, 'continents': continents, 'key': key}
+
+
+# function used in keying the server-side caches by a selection: the key is rebuilt from the years and continents
+# on the server, a key sent back by the browser could point to the content of another selection
+def selection_key(selection):
+    years = selection['years'] or (None, None)
+    return make_selection(*years, selection['continents'])['key']
+
+
+# ##### 1.7 wide panel of the data (country x year x indicator) shared by all callbacks
 
 # In[ ]:
 
 
+# dense country x year x indicator array built once from the long data frame
+class MacroPanel:
+
+    index_columns = ['Country Name', 'Country Code', 'year', 'Capital', 'Continent']
+
+    def __init__(self, data_frame):
+        # countries and indicators keep the order in which they appear in the long data frame
+        country_codes, countries = pd.factorize(data_frame['Country Name'])
+        indicator_codes, indicators = pd.factorize(data_frame['Series Name'])
+        self.countries = pd.Index(np.asarray(countries, dtype=object))
+        self.indicators = pd.Index(np.asarray(indicators, dtype=object))
+        self.years = np.sort(data_frame['year'].unique())
+        year_codes = np.searchsorted(self.years, data_frame['year'].to_numpy())
+
+        self.country_index = {country: i for i, country in enumerate(self.countries)}
+        self.indicator_index = {indicator: i for i, indicator in enumerate(self.indicators)}
+        self.year_index = {int(year): i for i, year in enumerate(self.years)}
+
+        shape = (len(self.countries), len(self.years), len(self.indicators))
+        self.values = np.full(shape, np.nan)
+        self.values[country_codes, year_codes, indicator_codes] = data_frame['value'].to_numpy()
+
+        # cells which exist as a row in the long data frame (their value can still be missing)
+        self.present = np.zeros(shape, dtype=bool)
+        self.present[country_codes, year_codes, indicator_codes] = True
+
+        # country metadata table, one row per country
+        self.country_info = (data_frame.drop_duplicates('Country Name')[['Country Name', 'Country Code', 'Capital', 'Continent']]
+                             .astype(object).reset_index(drop=True))
+        self.has_info = self.country_info[['Capital', 'Continent']].notna().all(axis=1).to_numpy()
+
+        # position of the countries sorted by name (row order of a pivot table)
+        self.name_order = np.argsort(self.countries.to_numpy().astype(str), kind='stable')
+
+        # row index of the selections, built once: positions of the countries of every continent
+        continent = self.country_info['Continent'].to_numpy()
+        self.continent_countries = {name: np.flatnonzero(continent == name)
+                                    for name in self.country_info['Continent'].dropna().unique()}
+
+    # positions of the countries of a set of continents (all countries if none): in the order of the panel and in
+    # the row order of a pivot table (sorted by name, without the countries lacking capital or continent)
+    # memoized: there are only 2^6 continent sets, the arrays are read only and shared between callbacks
+    @lru_cache(maxsize=64)
+    def continent_positions(self, continents):
+        if len(continents) == 0:
+            countries = np.arange(len(self.countries))
+        else:
+            countries = np.unique(np.concatenate([self.continent_countries.get(name, np.empty(0, dtype=np.intp))
+                                                  for name in continents]))
+        pivot_countries = self.name_order[np.isin(self.name_order, countries[self.has_info[countries]])]
+        countries.setflags(write=False)
+        pivot_countries.setflags(write=False)
+        return countries, pivot_countries
+
+    # positions of the countries in the continents of a selection
+    def country_positions(self, selection):
+        return self.continent_positions(tuple(selection['continents']))[0]
+
+    # positions of the countries of a selection in the row order of its pivot table
+    def pivot_positions(self, selection):
+        return self.continent_positions(tuple(selection['continents']))[1]
+
+    # positions of the years in the year range of a selection, memoized per year range
+    def year_positions(self, selection):
+        return self.year_range_positions(None if selection['years'] is None else tuple(selection['years']))
+
+    @lru_cache(maxsize=512)
+    def year_range_positions(self, years):
+        if years is None:
+            positions = np.arange(len(self.years))
+        else:
+            positions = np.flatnonzero((self.years >= years[0]) & (self.years <= years[1]))
+        positions.setflags(write=False)
+        return positions
+
+    # long data frame of one indicator (columns: Country, Year, indicator), rows ordered as in the main data frame
+    def indicator_frame(self, selection, indicator):
+        if not isinstance(indicator, str) or indicator not in self.indicator_index:
+            raise PreventUpdate
+        countries = self.country_positions(selection)
+        years = self.year_positions(selection)
+
+        i = self.indicator_index[indicator]
+        present = self.present[np.ix_(countries, years, [i])][:, :, 0].T
+        year_pos, country_pos = np.nonzero(present)
+
+        return pd.DataFrame({'Country': self.countries[countries[country_pos]],
+                             'Year': self.years[years[year_pos]],
+                             indicator: self.values[countries[country_pos], years[year_pos], i]})
+
+    # wide data frame of a selection, same result as
+    # pivot_table(index=index_columns, columns='Series Name', values='value', aggfunc='first').reset_index()
+    def wide(self, selection, indicators=None):
+        if indicators is None:
+            indicators = self.indicators
+        indicators = sorted(indicator for indicator in indicators if indicator in self.indicator_index)
+
+        # pivot tables drop the rows with missing index values, i.e. the countries without capital or continent
+        countries = self.pivot_positions(selection)
+        years = self.year_positions(selection)
+
+        ind = [self.indicator_index[indicator] for indicator in indicators]
+        values = self.values[np.ix_(countries, years, ind)].reshape(-1, len(ind))
+        present = self.present[np.ix_(countries, years, ind)].reshape(-1, len(ind))
+        values = np.where(present, values, np.nan)
+
+        info = self.country_info.iloc[np.repeat(countries, len(years))].reset_index(drop=True)
+        wide_df = pd.DataFrame(values, columns=pd.Index(indicators, name='Series Name'))
+        wide_df.insert(0, 'Country Name', info['Country Name'].to_numpy())
+        wide_df.insert(1, 'Country Code', info['Country Code'].to_numpy())
+        wide_df.insert(2, 'year', np.tile(self.years[years], len(countries)))
+        wide_df.insert(3, 'Capital', info['Capital'].to_numpy())
+        wide_df.insert(4, 'Continent', info['Continent'].to_numpy())
+
+        # drop rows and indicator columns without any value (as a pivot table does)
+        wide_df = wide_df[~np.isnan(values).all(axis=1)].reset_index(drop=True)
+        empty_columns = [indicator for indicator in indicators if wide_df[indicator].isna().all()]
+        return wide_df.drop(columns=empty_columns)
+
+    # values of some indicators in one year of a selection, with the rows of that year in the wide data frame:
+    # positions of the countries (sorted by name) and their (countries x indicators) values
+    def year_values(self, selection, year, indicators):
+        countries = self.pivot_positions(selection)
+        y = self.year_index[int(year)]
+
+        countries = countries[~np.isnan(self.values[countries, y]).all(axis=1)]
+        ind = [self.indicator_index[indicator] for indicator in indicators]
+        return countries, self.values[countries, y][:, ind]
+
+
+PANEL = MacroPanel(DF)
+
+
+# catalog of the labels in the dataset, dropdown options are built from it instead of the data frames
+CATALOG = {'indicators': PANEL.indicators.tolist(),
+           'countries': PANEL.countries.tolist(),
+           'continents': sorted(PANEL.country_info['Continent'].dropna().unique()),
+           'years': [int(year) for year in PANEL.years]}
+
+
+# function used in building the catalog of a selection (labels with at least one row in the selection)
+# memoized, keyed by year range and continents
+@lru_cache(maxsize=256)
+def selection_catalog_for(years, continents):
+    selection = {'years': years, 'continents': continents}
+    countries = PANEL.country_positions(selection)
+    years = PANEL.year_positions(selection)
+    present = PANEL.present[np.ix_(countries, years)]
+
+    return {'indicators': PANEL.indicators[present.any(axis=(0, 1))].tolist(),
+            'countries': PANEL.countries[countries[present.any(axis=(1, 2))]].tolist(),
+            'continents': sorted(PANEL.country_info['Continent'].iloc[countries].dropna().unique()),
+            'years': [int(year) for year in PANEL.years[years[present.any(axis=(0, 2))]]]}
+
+
+# function used in resolving the content of the stored-data component to its catalog
+def selection_catalog(selection):
+    if not isinstance(selection, dict) or 'key' not in selection:
+        raise PreventUpdate
+    years = None if selection['years'] is None else tuple(selection['years'])
+    return selection_catalog_for(years, tuple(selection['continents']))
+
+
+# mean and scale of every (year, indicator) over the countries of some continents, computed once from the panel
+# instead of fitting an imputer and a scaler per clustering request. they are the statistics of a mean imputation
+# followed by standard scaling of one year of the wide data frame: the variance of an imputed indicator is the
+# variance of its values x observed / rows. indicators without any value in a year have mean 0 and scale 1
+@lru_cache(maxsize=64)
+def indicator_stats_for(continents):
+    countries = PANEL.country_positions({'continents': continents})
+    values = PANEL.values[countries[PANEL.has_info[countries]]]  # (countries, years, indicators)
+
+    observed = ~np.isnan(values)
+    count = observed.sum(axis=0)
+    rows = observed.any(axis=2).sum(axis=0)  # countries in the wide data frame of every year
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(values, axis=0) / count
+        variance = np.nansum((values - mean) ** 2, axis=0) / rows[:, None]
+
+    empty = count == 0
+    mean[empty] = 0.0
+    variance[empty] = 0.0
+
+    # constant indicators are not scaled, with the tolerance of StandardScaler
+    eps = np.finfo(np.float64).eps
+    constant = variance <= rows[:, None] * eps * variance + (rows[:, None] * mean * eps) ** 2
+    return {'mean': mean, 'scale': np.where(constant, 1.0, np.sqrt(variance)), 'count': count, 'rows': rows}
+
+
+# function used in resolving a selection to the statistics of its continents
+def indicator_stats(selection):
+    return indicator_stats_for(tuple(selection['continents']))
+
+
+# ##### 1.8 column-oriented encoding of the data frames kept in browser stores
+
+# In[ ]:
+
+
+# data frames in dcc.Store components (cluster and peer analysis data) are sent as one list of values per column:
+# {'columns', 'dtypes', 'data'}, instead of to_dict('records') that repeats every column name in every row.
+# numeric and boolean columns keep their dtype, other columns are sent as python objects (as in records)
+def encode_frame(data_frame):
+    dtypes = [str(dtype) if (pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype)) 
+              and not isinstance(dtype, pd.CategoricalDtype) else 'object' 
+              for dtype in data_frame.dtypes]
+    return {'columns': [str(column) for column in data_frame.columns],
+            'dtypes': dtypes,
+            'data': [data_frame[column].tolist() for column in data_frame.columns]}
+
+
+# function used in reading one column of a store as a series of its stored dtype, without decoding the whole
+# data frame: missing numbers arrive as null and are read back as NaN, stores still holding records (older sessions)
+# are read as python objects
+def store_column(stored_frame, column):
+    if isinstance(stored_frame, list):
+        return pd.Series([row.get(column) for row in stored_frame], dtype=object, name=column)
+    if not isinstance(stored_frame, dict) or column not in stored_frame.get('columns', []):
+        return None
+    i = stored_frame['columns'].index(column)
+    return pd.Series(stored_frame['data'][i], dtype=stored_frame['dtypes'][i], name=column)
 
 
 
@@ -96,7 +583,11 @@ DF = pd.read_excel('data/macro_data_melted_df2.xlsx')
 # In[7]:
 
 
-app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.BOOTSTRAP])
+# long running callbacks (clustering) run as background jobs in separate processes, job results are kept in a local disk cache
+background_callback_manager = DiskcacheManager(diskcache.Cache(os.path.join(CACHE_DIR, 'background')))
+
+app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.BOOTSTRAP],
+           background_callback_manager=background_callback_manager)
 
 # Set the title of the app
 app.title = 'Macro Data Explorer'
@@ -266,7 +757,8 @@ data_setup_section = html.Div([
                
         ], justify='center', className='g-10'),
         
-        dcc.Store(id="stored-data", storage_type="local", data={}),  # store updated data from user
+        dcc.Store(id="stored-data", storage_type="local", data={}),  # store data selection from user (filtered data is kept on the server)
+        dcc.Store(id="animated-data-chart-frames", data={}),  # columnar top 20 per year of the chart indicator, zoomed in the browser
         
     ], className="content") # Use the "content" class from css for styling 
 
@@ -335,7 +827,7 @@ cluster_section = html.Div([
                    html.H6('Select indicators for clustering (max 5):'),
                    
                    dcc.Dropdown(id='cluster-indicators-dropdown',
-                                 options=[{'label': indicator, 'value': indicator} for indicator in DF['Series Name'].unique()],
+                                 options=[{'label': indicator, 'value': indicator} for indicator in CATALOG['indicators']],
                                  multi=True,
                                  className='dropdown',
                                  placeholder='Select indicators...',
@@ -358,6 +850,13 @@ cluster_section = html.Div([
                                ),
                    ]),
                    
+                   # batch mode: every year of the data setup range is clustered in one job, the map is animated
+                   # over the years and switching the cluster year is answered without new fits
+                   dbc.Switch(id='cluster-all-years-switch',
+                              label='Cluster every year of the range',
+                              value=False,
+                              style={'font-family': "Calibri Light, sans-serif", 'margin-top': '5px'}),
+                   
                    html.Br(),
                    
                    html.H6('Select no of clusters:'),
@@ -368,6 +867,13 @@ cluster_section = html.Div([
                       id = 'cluster-number-slider',
                       tooltip={"placement": "bottom", "always_visible": True}),
                    
+                   # inertia and silhouette of every no of clusters, shown after the first submit
+                   dcc.Graph(id='cluster-k-sweep-chart', 
+                             config={'displayModeBar': False},
+                             style={'display': 'none'}),
+                   
+                   html.Br(),
+                   
                    dbc.Button('Submit', 
                                   id='submit-cluster-settings-button', 
                                   n_clicks=0, outline=True, 
@@ -375,6 +881,24 @@ cluster_section = html.Div([
                                   className='button',
                                    style={'display': 'block', 'margin': 'auto'}
                                  ),               
+                   
+                   # progress of the clustering job, only visible while the job is running
+                   dbc.Progress(id='cluster-progress-bar', 
+                                value=0, 
+                                label='',
+                                striped=True, 
+                                animated=True,
+                                style={'display': 'none'}
+                               ),
+                   
+                   dbc.Button('Cancel', 
+                                  id='cancel-cluster-settings-button', 
+                                  n_clicks=0, outline=True, 
+                                  color='secondary',
+                                  className='button',
+                                  disabled=True,
+                                   style={'display': 'block', 'margin': 'auto', 'margin-top': '5px'}
+                                 ),
                
                    
                ], style={"border": "0px ridge silver",  # 2px border with black color
@@ -391,6 +915,7 @@ cluster_section = html.Div([
                    dcc.Loading(
                          dcc.Graph(id='cluster-chart'), 
                          type="cube"),
+                   dcc.Store(id='cluster-chart-state', data=None),  # set once the base figure of the cluster map is shown
   
                ], style={"border": "0px ridge silver", # 2px border with black color
                          'box-shadow': '12px 12px 12px 12px rgba(0, 0, 0, 0.2)',
@@ -440,10 +965,65 @@ cluster_section = html.Div([
                    html.Br(),
                    
                    dcc.Loading(
-                        html.Div(id='datatable-container'),
+                        html.Div([
+                            # pages, filters and sorting are answered by the server, only the visible page is sent
+                            dash_table.DataTable(
+                                id='datatable-interactivity',
+                                columns=[],
+                                data=[],
+                                editable=True,              # allow editing of data inside all cells
+                                filter_action="custom",     # filter_query is applied on the server
+                                filter_query='',
+                                sort_action="custom",       # sort_by is applied on the server
+                                sort_mode="single",         # sort across 'multi' or 'single' columns
+                                sort_by=[],
+                                column_selectable="multi",  # allow users to select 'multi' or 'single' columns
+                                row_selectable="multi",     # allow users to select 'multi' or 'single' rows
+                                row_deletable=True,         # choose if user can delete a row (True) or not (False)
+                                selected_columns=[],        # ids of columns that user selects
+                                selected_rows=[],           # indices of rows that user selects
+                                page_action="custom",       # pages are requested from the server one at a time
+                                page_current=0,             # page number that user is on
+                                page_size=10,               # number of rows visible per page
+                                style_cell={                # ensure adequate header width when text is shorter than cell's text
+                                    'minWidth': 95, 'maxWidth': 95, 'width': 95
+                                },
+                                style_cell_conditional=[    # align text columns to left. By default they are aligned to right
+                                    {'if': {'column_id': c},
+                                        'textAlign': 'left'
+                                    } for c in ['Country Name', 'Country Code']
+                                ],
+                                
+                                style_data={                # overflow cells' content into multiple lines
+                                    'whiteSpace': 'normal',
+                                    'height': 'auto'
+                                },
+                                
+                                style_table={
+                                            'overflowX': 'auto',  # Enable horizontal scrolling if needed
+                                            'height': '400px',    # Set the desired height of the table
+                                            'width': '100%',      # Set the width of the table to 100% of the container
+                                        },
+                            ),
+                            dcc.Store(id='datatable-key', data=None),  # key of the table rows in TABLE_CACHE
+                        ], id='datatable-container'),
                         type="cube"
                    ),
                    
+                   # file format of the cluster analysis download
+                   dcc.Dropdown(id='download-cluster-format-dropdown',
+                                options=[
+                                    {'label': 'Excel (.xlsx)', 'value': 'xlsx'},
+                                    {'label': 'CSV (.zip)', 'value': 'csv'},
+                                    {'label': 'Parquet (.zip)', 'value': 'parquet', 'disabled': not PARQUET_AVAILABLE},
+                                ],
+                                value='xlsx',
+                                multi=False,
+                                clearable=False,
+                                className='dropdown',
+                                style={'width': '155px', 'margin': '10px auto 5px auto'},
+                   ),
+                   
                    dbc.Button('Download',
                               id='download-cluster-analysis-button', 
                               n_clicks=0, outline=True, 
@@ -467,7 +1047,7 @@ cluster_section = html.Div([
        ], justify='center', className='g-10'),
        
        
-       dcc.Store(id="stored-cluster-data", storage_type="local", data={}),  # store updated data from user
+       dcc.Store(id="stored-cluster-data", storage_type="local", data={}),  # cluster result: labels, centroids and run settings
        
        dcc.Download(id='download-cluster-dataset-component'), # download cluster analysis data set
          
@@ -632,6 +1212,7 @@ peer_analysis_section =  html.Div([
                     dcc.Loading(
                         dcc.Graph(id='peer-analysis-location-chart'), 
                          type="cube"),
+                    dcc.Store(id='peer-analysis-location-chart-state', data=None),  # peer data of the map shown, for patches
                     
                     
                 ], style={"border": "0px ridge white",  # 2px border with black color
@@ -645,7 +1226,7 @@ peer_analysis_section =  html.Div([
         
         html.Div(id='hidden-trigger', style={'display': 'none'}),  # Hidden div to act as an input -- temporary
         
-        dcc.Store(id="stored-peer-analysis-data", storage_type="local", data={}),  # store updated data from user
+        dcc.Store(id="peer-comparison-chart-state", data=None),  # countries and indicator shown in the peer comparison chart, for patches
         
     ], className="content")
 
@@ -1055,25 +1636,13 @@ app.layout = html.Div([
 # In[20]:
 
 
-@app.callback(
+# toggle collapse in the browser (assets/clientside.js), no request to the server
+app.clientside_callback(
+    ClientsideFunction(namespace='macro_explorer', function_name='toggle_collapse'),
     Output("data-setup-collapse", "is_open"),
     [Input("data-setup-collapse-button", "n_clicks")],
     [State("data-setup-collapse", "is_open")],
 )
-def toggle_data_setup_collapse(n, is_open):
-    if n:
-        return not is_open
-    return is_open
-
-
-# In[21]:
-
-
-# function used in creating dataframe from selected indicator
-def create_data_frame_from_indicator(data_frame, indicator):
-    df = data_frame[data_frame["Series Name"]==indicator]
-    df.rename(columns={'year':'Year', 'value':indicator, 'Country Name':'Country'}, inplace=True)    
-    return df
 
 
 # In[22]:
@@ -1089,25 +1658,14 @@ def create_data_frame_from_indicator(data_frame, indicator):
 
 def update_data(n_clicks, data_range_selected, continents_chosen):
     
-    main_df = DF.copy()
-    
+    # only the selection is sent to the browser, the data is read from the panel on the server
     if n_clicks is None:
-        return main_df.to_dict('records')
+        return make_selection()
     
     else:
         start_year, end_year = data_range_selected
         
-        # Filter the DataFrame based on the selected year range
-        range_updated_dataframe = main_df[main_df['year'].between(start_year, end_year)]
-        
-        # Filter the DataFrame based on the selected continents
-        if len(continents_chosen) == 0:
-            
-            return range_updated_dataframe.to_dict('records') # if no continents are specied, all are selected by default
-        
-        continents_updated_dataframe = range_updated_dataframe[range_updated_dataframe["Continent"].isin(continents_chosen)]
-        
-        return continents_updated_dataframe.to_dict('records')
+        return make_selection(start_year, end_year, continents_chosen)
 
 
 # In[23]:
@@ -1121,11 +1679,8 @@ def update_data(n_clicks, data_range_selected, continents_chosen):
 )
 def update_dropdown_options(stored_data):
     if stored_data is not None:
-        # Convert stored data to a DataFrame
-        df = pd.DataFrame(stored_data)
-
-        # Get all unique entries from the 'label' column
-        unique_labels = df['Series Name'].unique()
+        # Get the indicators of the stored selection from the catalog
+        unique_labels = selection_catalog(stored_data)['indicators']
 
         # Create options for the Dropdown
         options = [{'label': label, 'value': label} for label in unique_labels]
@@ -1138,39 +1693,89 @@ def update_dropdown_options(stored_data):
         return [], []
 
 
+# In[ ]:
+
+
+# function used in keeping the n largest values of each year, sorted descending within the year
+# same rows and order as groupby('Year').apply(lambda group: group.nlargest(n, variable)), with a single sort
+def top_n_per_year(data_frame, variable, n=20, year_column='Year'):
+    ranked = data_frame[data_frame[variable].notna()]
+    ranked = ranked.sort_values([year_column, variable], ascending=[True, False], kind='stable')
+    return ranked[ranked.groupby(year_column).cumcount().to_numpy() < n].reset_index(drop=True)
+
+
 # In[24]:
 
 
-# callback for updating data setup explore chart
-@app.callback(
-    Output('animated-data-chart', 'figure'),
-    Input('animated-data-chart', 'relayoutData'),
-    Input("stored-data", "data"),
-    Input("data-chart-variable-dropdown", "value"),
-)
+# serialized figures of the animated data chart, keyed by (selection, indicator, zoom range or 'frames')
+FIGURE_CACHE = LRUCache(maxsize=64)
 
-def update_data_graph(relayout_data, stored_data, selected_variable):
+
+# function used in building the animated data chart of the top 20 countries per year, without zoom
+def initial_data_figure(df_initial, selected_variable):
     
-    if stored_data is not None:
-        # Convert stored data to a DataFrame
-        macro_df = pd.DataFrame(stored_data)
+    px = analytics_modules().px
+            
+    fig = px.bar(df_initial, x=selected_variable, y='Country', color='Country', animation_frame='Year',
+                 labels={selected_variable: selected_variable, 'Country': 'Country', 'Year': 'Year'},
+                 height=850,
+                 title=f'{selected_variable} over time by country - top 20')
+    
+    # Set initial y-axis based on the initial top 20 countries
+    fig.update_layout(yaxis=dict(categoryorder='total descending', categoryarray=df_initial['Country'].unique()[:20][::-1]))
+    
+    fig.layout.geo.bgcolor = '#E5ECF6'
+    
+    # Set initial x-axis range
+    max_value_initial = df_initial[selected_variable].max()
+    fig.update_xaxes(range=[0, max_value_initial])
+    
+    # Set initial animation duration
+    fig.update_layout(updatemenus=[dict(type='buttons', showactive=False, buttons=[dict(label='Play',
+                        method='animate', args=[None, dict(frame=dict(duration=1200, redraw=True),
+                                                          fromcurrent=True)]),
+                                                        dict(label='Pause',
+                        method='animate', args=[[None], dict(frame=dict(duration=0, redraw=True),
+                                                           mode='immediate')],
+                        )])])
+    
+    # Add annotations for source and copyright
+    fig.update_layout(
+        annotations=[
+                dict(
+                    xref="paper", yref="paper",
+                    x=1, y=-0.05,
+                    xanchor="right", yanchor="bottom",
+                    text="Source: World Bank Data",
+                    showarrow=False,
+                    font=dict(size=10)
+                ),
+        ]
+    )
+    return fig
+
+
+# function used in building the animated data chart, x_range is the (start, end) of a zoom or None
+def build_data_figure(stored_data, selected_variable, x_range):
+    
+    px = analytics_modules().px
         
-    df_long = create_data_frame_from_indicator(macro_df, selected_variable)
+    # long data frame of the selected indicator from the wide panel
+    df_long = PANEL.indicator_frame(stored_data, selected_variable)
         
     # Initial filtering to include only the top 20 countries
-    df_initial = df_long.groupby('Year').apply(lambda group: group.nlargest(20, selected_variable)).reset_index(drop=True)
+    df_initial = top_n_per_year(df_long, selected_variable, 20)
     
     # Sort DataFrame based on the current animation frame
-    if 'xaxis.range[0]' in relayout_data:
+    if x_range is not None:
         print('im after initial plot')
-        start_year = int(relayout_data['xaxis.range[0]'])
-        end_year = int(relayout_data['xaxis.range[1]'])
+        start_year, end_year = x_range
         df_filtered = df_long[df_long['Year'].between(start_year, end_year)]
         df_sorted = df_filtered.groupby('Country')[selected_variable].max().sort_values(ascending=False).index
         df_filtered['Country'] = pd.Categorical(df_filtered['Country'], categories=df_sorted, ordered=True)
         
         # Keep only the top 20 countries for each year
-        dff = df_filtered.groupby('Year').apply(lambda group: group.nlargest(20, selected_variable)).reset_index(drop=True)
+        dff = top_n_per_year(df_filtered, selected_variable, 20)
         
         # Stick to a list of the top 20 countries
         countries_to_keep = dff['Country'].unique()[:20]
@@ -1223,44 +1828,92 @@ def update_data_graph(relayout_data, stored_data, selected_variable):
         return fig
     
     else:
-                
-        fig = px.bar(df_initial, x=selected_variable, y='Country', color='Country', animation_frame='Year',
-                     labels={selected_variable: selected_variable, 'Country': 'Country', 'Year': 'Year'},
-                     height=850,
-                     title=f'{selected_variable} over time by country - top 20')
-        
-        # Set initial y-axis based on the initial top 20 countries
-        fig.update_layout(yaxis=dict(categoryorder='total descending', categoryarray=df_initial['Country'].unique()[:20][::-1]))
-        
-        fig.layout.geo.bgcolor = '#E5ECF6'
-        
-        # Set initial x-axis range
-        max_value_initial = df_initial[selected_variable].max()
-        fig.update_xaxes(range=[0, max_value_initial])
+        return initial_data_figure(df_initial, selected_variable)
+
+
+# zoom of the animated data chart in the browser (assets/clientside.js): the server sends the ranked frames once
+# per indicator, set MACRO_EXPLORER_CLIENTSIDE_ZOOM=0 to rebuild the figure on the server on every zoom
+CLIENTSIDE_ZOOM = os.environ.get('MACRO_EXPLORER_CLIENTSIDE_ZOOM', '1') != '0'
+
+
+# function used in building the columnar frames of the animated data chart: the top 20 countries of every year
+# as Year, Country (codes into countries) and value arrays, with the layout of the unzoomed figure
+def build_data_frames(stored_data, selected_variable):
+    
+    df_long = PANEL.indicator_frame(stored_data, selected_variable)
+    df_initial = top_n_per_year(df_long, selected_variable, 20)
+    
+    country_codes, countries = pd.factorize(df_initial['Country'])
+    
+    # the layout only needs two frames, the browser builds the traces, slider steps and axes of the selection
+    layout_years = df_initial['Year'].unique()[:2]
+    layout_figure = initial_data_figure(df_initial[df_initial['Year'].isin(layout_years)], selected_variable)
+    layout = json.loads(layout_figure.to_json())['layout']
+    
+    return {'indicator': selected_variable,
+            'layout': layout,
+            'countries': [str(country) for country in countries],
+            'Year': df_initial['Year'].astype(int).tolist(),
+            'Country': country_codes.tolist(),
+            'value': df_initial[selected_variable].astype(float).tolist()}
+
+
+def update_data_graph_frames(stored_data, selected_variable):
+    
+    if not isinstance(stored_data, dict) or 'key' not in stored_data:
+        raise PreventUpdate
+    
+    cache_key = (selection_key(stored_data), selected_variable, 'frames')
+    frames_json = FIGURE_CACHE.get(cache_key)
+    
+    if frames_json is None:
+        frames_json = json.dumps(build_data_frames(stored_data, selected_variable))
+        FIGURE_CACHE.put(cache_key, frames_json)
         
-        # Set initial animation duration
-        fig.update_layout(updatemenus=[dict(type='buttons', showactive=False, buttons=[dict(label='Play',
-                            method='animate', args=[None, dict(frame=dict(duration=1200, redraw=True),
-                                                              fromcurrent=True)]),
-                                                            dict(label='Pause',
-                            method='animate', args=[[None], dict(frame=dict(duration=0, redraw=True),
-                                                               mode='immediate')],
-                            )])])
+    return json.loads(frames_json)
+
+
+# callback for updating data setup explore chart
+def update_data_graph(relayout_data, stored_data, selected_variable):
+    
+    if not isinstance(stored_data, dict) or 'key' not in stored_data:
+        raise PreventUpdate
+    
+    x_range = None
+    if relayout_data is not None and 'xaxis.range[0]' in relayout_data:
+        x_range = (int(relayout_data['xaxis.range[0]']), int(relayout_data['xaxis.range[1]']))
+    
+    # figures are cached as json, repeated views skip building the figure
+    cache_key = (selection_key(stored_data), selected_variable, x_range)
+    figure_json = FIGURE_CACHE.get(cache_key)
+    
+    if figure_json is None:
+        figure_json = build_data_figure(stored_data, selected_variable, x_range).to_json()
+        FIGURE_CACHE.put(cache_key, figure_json)
         
-        # Add annotations for source and copyright
-        fig.update_layout(
-            annotations=[
-                    dict(
-                        xref="paper", yref="paper",
-                        x=1, y=-0.05,
-                        xanchor="right", yanchor="bottom",
-                        text="Source: World Bank Data",
-                        showarrow=False,
-                        font=dict(size=10)
-                    ),
-            ]
-        )
-        return fig
+    return json.loads(figure_json)
+
+
+if CLIENTSIDE_ZOOM:
+    app.callback(
+        Output('animated-data-chart-frames', 'data'),
+        Input("stored-data", "data"),
+        Input("data-chart-variable-dropdown", "value"),
+    )(update_data_graph_frames)
+    
+    app.clientside_callback(
+        ClientsideFunction(namespace='macro_explorer', function_name='animated_chart_figure'),
+        Output('animated-data-chart', 'figure'),
+        Input('animated-data-chart', 'relayoutData'),
+        Input('animated-data-chart-frames', 'data'),
+    )
+else:
+    app.callback(
+        Output('animated-data-chart', 'figure'),
+        Input('animated-data-chart', 'relayoutData'),
+        Input("stored-data", "data"),
+        Input("data-chart-variable-dropdown", "value"),
+    )(update_data_graph)
 
 
 # In[ ]:
@@ -1274,15 +1927,13 @@ def update_data_graph(relayout_data, stored_data, selected_variable):
 # In[25]:
 
 
-@app.callback(
+# toggle collapse in the browser (assets/clientside.js), no request to the server
+app.clientside_callback(
+    ClientsideFunction(namespace='macro_explorer', function_name='toggle_collapse'),
     Output("cluster-analysis-collapse", "is_open"),
     [Input("cluster-analysis-collapse-button", "n_clicks")],
     [State("cluster-analysis-collapse", "is_open")],
 )
-def toggle_cluster_analysis_collapse(n, is_open):
-    if n:
-        return not is_open
-    return is_open
 
 
 # In[26]:
@@ -1292,81 +1943,198 @@ def convert_to_group_name(num):
     return f'Group {num}'
 
 
-# In[27]:
+# seed of the k-means fits, identical submissions always return identical clusters
+CLUSTER_RANDOM_STATE = 0
 
+# clustering results shared by all users and processes (clustering runs in background jobs)
+CLUSTER_CACHE = diskcache.Cache(os.path.join(CACHE_DIR, 'clusters'), 
+                                eviction_policy='least-recently-used', 
+                                size_limit=64 * 2**20)
+CLUSTER_CACHE.stats(enable=True)
 
-# callback for updating cluster chart
-@app.callback(
-    Output('cluster-chart', 'figure'),
-    Output('cluster-group-dropdown', 'options'),
-    Output('cluster-group-dropdown', 'value'),
-    Output('cluster-group-indicator-dropdown', 'options'),
-    Output('cluster-group-indicator-dropdown', 'value'),
-    Output("stored-cluster-data", "data"),
-    Input('submit-cluster-settings-button', 'n_clicks'),
-    State("stored-data", "data"), 
-    State("cluster-indicators-dropdown", "value"),
-    State("cluster-indicators-year-dropdown", "value"),
-    State("cluster-number-slider", "value"),
-)
-    
-def update_cluster_graph(n_clicks, stored_data, indicators, 
-                         cluster_year, n_clusters):
-    
-    if not n_clicks:
-        raise PreventUpdate 
-        
-    imp = SimpleImputer(missing_values=np.nan, strategy='mean')
-    scaler = StandardScaler()
-    kmeans = KMeans(n_clusters=n_clusters)
 
-    # transform data frame
-    data_frame = pd.DataFrame(stored_data).copy()
+# function used in creating the cache key of a clustering run from the selection and a hash of the input data
+def cluster_cache_key(stored_data, indicators, cluster_year, n_clusters, data):
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    data_hash = hashlib.sha1(data.tobytes() + str(data.shape).encode()).hexdigest()
+    return json.dumps([stored_data['continents'], list(indicators), cluster_year, n_clusters, data_hash])
 
-    # extract indicators to be used as dropdown in cluster table
-    indicators_list = data_frame['Series Name'].tolist()
-    indicators_options = [{'label': label, 'value': label} for label in indicators_list]
-    indicator_value = indicators[0] # active indicator for table
 
+# function used in fitting k-means (or getting a previous fit from the cache): labels, inertia and centroids
+def fit_clusters(scaled_data, n_clusters, cache_key=None):
+    if cache_key is not None:
+        result = CLUSTER_CACHE.get(cache_key)
+        if result is not None:
+            return result
 
-    df_transformed = data_frame.pivot_table(index=['Country Name', 'Country Code', 'year', 'Capital','Continent'],
-                                          columns='Series Name', values='value', aggfunc='first').reset_index()   
-    
-    # filter data between two dates provided
-    filtered_df = df_transformed.loc[(df_transformed['year'] == cluster_year)]
+    kmeans = analytics_modules().KMeans(n_clusters=n_clusters, n_init=10, random_state=CLUSTER_RANDOM_STATE)
+    labels = kmeans.fit_predict(scaled_data).astype(int)
+    result = {'labels': labels, 'inertia': float(kmeans.inertia_), 'centroids': kmeans.cluster_centers_}
 
-    # impute missing values with the mean of each column
-    filtered_df[indicators] = imp.fit_transform(filtered_df[indicators])
+    if cache_key is not None:
+        CLUSTER_CACHE.set(cache_key, result)
+    return result
 
-    data_no_na = filtered_df[indicators] 
 
-    # scale DataFrame
-    scaled_data = scaler.fit_transform(data_no_na)
+# number of clusters covered by the k sweep (same range as the cluster-number-slider)
+K_SWEEP_VALUES = list(range(1, 11))
 
-    # use k-means clustering on the imputed DataFrame
-    df_clusters = filtered_df.copy()
-    df_clusters['Cluster'] = kmeans.fit_predict(scaled_data).astype(int) # kmeans.fit(scaled_data)
 
-    # sort dataframe by group assignment
-    df_clusters.sort_values(by='Cluster', ascending=True, inplace=True)
+# function used in fitting every k of the sweep on the same scaled data: inertia (elbow) and silhouette per k
+# each fit goes through the clustering cache, so any k of a swept selection is available without refitting
+def sweep_clusters(stored_data, indicators, cluster_year, scaled_data, progress=None):
+    sweep_key = cluster_cache_key(stored_data, indicators, cluster_year, 'sweep', scaled_data)
+    sweep = CLUSTER_CACHE.get(sweep_key)
+    if sweep is not None:
+        return sweep
+
+    n_samples = len(scaled_data)
+    k_values = [k for k in K_SWEEP_VALUES if k <= n_samples]
+    sweep = {'k': k_values, 'inertia': [], 'silhouette': []}
+    for i, k in enumerate(k_values):
+        if progress is not None:
+            progress(i, len(k_values))
+        cache_key = cluster_cache_key(stored_data, indicators, cluster_year, k, scaled_data)
+        result = fit_clusters(scaled_data, k, cache_key)
+        sweep['inertia'].append(result['inertia'])
+
+        # silhouette is only defined for 2 <= k <= n_samples - 1
+        if 2 <= k < n_samples:
+            sweep['silhouette'].append(float(analytics_modules().silhouette_score(scaled_data, result['labels'])))
+        else:
+            sweep['silhouette'].append(None)
+
+    CLUSTER_CACHE.set(sweep_key, sweep)
+    return sweep
+
+
+# function used in imputing missing values with the mean of each indicator and scaling the indicators of one year,
+# a broadcast with the precomputed statistics of the selection (indicator_stats): data frame of the year with the
+# imputed values, scaled data and the (mean, scale) of the indicators to bring centroids back to indicator units
+def prepare_cluster_data(stored_data, year, indicators):
+    stats = indicator_stats(stored_data)
+    countries, values = PANEL.year_values(stored_data, year, indicators)
+
+    y = PANEL.year_index[int(year)]
+    ind = [PANEL.indicator_index[indicator] for indicator in indicators]
+    mean, scale = stats['mean'][y, ind], stats['scale'][y, ind]
+    imputed = np.where(np.isnan(values), mean, values)
+
+    df_year = pd.DataFrame(imputed, columns=indicators)
+    df_year.insert(0, 'Country Name', PANEL.countries[countries])
+    df_year.insert(1, 'Country Code', PANEL.country_info['Country Code'].to_numpy()[countries])
+    return df_year, (imputed - mean) / scale, (mean, scale)
+
+
+# function used in listing the years of a selection which can be clustered: every indicator has a value
+# and there are at least as many countries as clusters
+def cluster_years(stored_data, indicators, n_clusters):
+    stats = indicator_stats(stored_data)
+    years = PANEL.year_positions(stored_data)
+    ind = [PANEL.indicator_index[indicator] for indicator in indicators]
+
+    valid = (stats['count'][np.ix_(years, ind)] > 0).all(axis=1) & (stats['rows'][years] >= n_clusters)
+    return [int(year) for year in PANEL.years[years[valid]]]
+
+
+# function used in renumbering the groups of a year after the groups of the previous year: groups are matched on
+# their centroids with the Hungarian algorithm (smallest total distance), so a group keeps its number over the years
+def align_clusters(previous_centroids, centroids):
+    distances = np.linalg.norm(previous_centroids[:, None, :] - centroids[None, :, :], axis=2)
+    previous_groups, groups = analytics_modules().linear_sum_assignment(distances)
+    relabel = np.empty(len(centroids), dtype=int)
+    relabel[groups] = previous_groups
+    return relabel
+
+
+# function used in clustering every year of a selection with the same indicators and k (batch mode), year_data holds
+# prepare_cluster_data of every year. the years are fitted one after the other through the clustering cache (each
+# k-means fit already runs on all cores) and groups are aligned from year to year: year x country matrix of the
+# groups (-1 without data), inertia and centroids per year
+def cluster_membership(stored_data, indicators, n_clusters, year_data, progress=None):
+    years = list(year_data)
+    year_keys = [cluster_cache_key(stored_data, indicators, year, n_clusters, year_data[year][1]) for year in years]
+    membership_key = json.dumps(['membership', year_keys])
+    membership = CLUSTER_CACHE.get(membership_key)
+    if membership is not None:
+        return membership
+
+    results = {}
+    for i, (year, year_key) in enumerate(zip(years, year_keys)):
+        if progress is not None:
+            progress(i, len(years))
+        results[year] = fit_clusters(year_data[year][1], n_clusters, year_key)
+
+    countries = sorted(set(country for df_year, _, _ in year_data.values() for country in df_year['Country Name']))
+    country_index = {country: i for i, country in enumerate(countries)}
+
+    labels = np.full((len(years), len(countries)), -1, dtype=np.int16)
+    inertia, centroids = [], []
+    previous_centroids = None
+    for row, year in enumerate(years):
+        df_year, _, (mean, scale) = year_data[year]
+        result = results[year]
+
+        # the first year keeps the numbering of its fit, the following years are renumbered after the year before
+        if previous_centroids is None:
+            relabel = np.arange(len(result['centroids']))
+        else:
+            relabel = align_clusters(previous_centroids, result['centroids'])
+        previous_centroids = np.empty_like(result['centroids'])
+        previous_centroids[relabel] = result['centroids']
+
+        labels[row, [country_index[country] for country in df_year['Country Name']]] = relabel[result['labels']]
+        inertia.append(result['inertia'])
+        centroids.append(previous_centroids * scale + mean)
+
+    membership = {'key': membership_key, 'years': years, 'countries': countries, 'labels': labels, 
+                  'inertia': inertia, 'centroids': centroids}
+    CLUSTER_CACHE.set(membership_key, membership)
+    return membership
+
+
+# function used in reading the groups of the countries of one year from the membership of a batch run
+def membership_labels(membership, year, countries):
+    country_index = {country: i for i, country in enumerate(membership['countries'])}
+    row = membership['labels'][membership['years'].index(year)]
+    return row[[country_index[country] for country in countries]].astype(int)
+
+
+# function used in drawing the small elbow / silhouette chart next to the cluster number slider
+def build_k_sweep_figure(sweep, n_clusters):
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=sweep['k'], y=sweep['inertia'], name='Inertia', mode='lines+markers'))
+    fig.add_trace(go.Scatter(x=sweep['k'], y=sweep['silhouette'], name='Silhouette', mode='lines+markers', yaxis='y2'))
+    fig.add_vline(x=n_clusters, line_dash='dot', line_color='gray')
+    fig.update_layout(height=220,
+                      margin=dict(l=10, r=10, t=30, b=10),
+                      title=dict(text='Elbow & silhouette by no of clusters', font=dict(size=12)),
+                      xaxis=dict(dtick=1),
+                      yaxis=dict(title='Inertia', showgrid=False),
+                      yaxis2=dict(title='Silhouette', overlaying='y', side='right', showgrid=False),
+                      legend=dict(orientation='h', y=-0.2),
+                      paper_bgcolor='#E5ECF6')
+    return fig
 
-    # rename group
-    df_clusters['Cluster'] = df_clusters['Cluster'].apply(convert_to_group_name)
 
-    fig = px.choropleth(df_clusters,
-                  locations='Country Name',
-                  locationmode='country names',
+# base figure of the cluster map (template, geo layout and legend), built once: a request only adds the traces
+# of its clusters, located by ISO-3 country code instead of resolving country names
+@lru_cache(maxsize=None)
+def cluster_map_base():
+    px = analytics_modules().px
+    
+    fig = px.choropleth(pd.DataFrame({'Country Code': ['USA'], 'Cluster': ['Group 0']}),
+                  locations='Country Code',
+                  locationmode='ISO-3',
                   color='Cluster', 
                   labels={'color': 'Cluster'},
-                  hover_data=indicators,
                   height=700,
-                  title=f'Country cluster period - {cluster_year}. Number of clusters: {n_clusters}<br>Inertia: {kmeans.inertia_:,.2f}',
-                  color_discrete_sequence=px.colors.qualitative.T10)
+                  title='Country cluster period')  # title text is set per request, a title keeps px from adding a top margin
 
     # Add annotations for indicators selected for clustering
     fig.add_annotation(x=0.5, y=-0.15, 
                        xref='paper', yref='paper',
-                       text='Selected Cluster Indicators:<br>' + "<br>".join(indicators), 
+                       text='', 
                        showarrow=False)
     
 #     # Add annotations for source and copyright
@@ -1397,6 +2165,242 @@ def update_cluster_graph(n_clicks, stored_data, indicators,
     fig.layout.paper_bgcolor = '#E5ECF6' #'#F2F2F2'
     fig.layout.geo.countrycolor = 'gray'
     fig.layout.geo.coastlinecolor = 'gray'
+    
+    return json.dumps(json.loads(fig.to_json())['layout'])
+
+
+# function used in building one choropleth trace per cluster group (as px.choropleth with a discrete color):
+# countries located by ISO-3 code, named in the hover, groups colored in order of appearance
+def cluster_map_traces(df_clusters, indicators):
+    colors = analytics_modules().px.colors.qualitative.T10
+    
+    traces = []
+    for position, (cluster, group) in enumerate(df_clusters.groupby('Cluster', sort=False)):
+        color = colors[position % len(colors)]
+        hover_lines = ([f'Cluster={cluster}', 'Country Name=%{hovertext}'] 
+                       + [f'{indicator}=%{{customdata[{i}]}}' for i, indicator in enumerate(indicators)])
+        traces.append({'colorscale': [[0.0, color], [1.0, color]],
+                       'customdata': group[indicators].to_numpy().tolist(),
+                       'geo': 'geo',
+                       'hovertemplate': '<br>'.join(hover_lines) + '<extra></extra>',
+                       'hovertext': group['Country Name'].tolist(),
+                       'locationmode': 'ISO-3',
+                       'locations': group['Country Code'].tolist(),
+                       'name': cluster,
+                       'showlegend': True,
+                       'showscale': False,
+                       'z': [1] * len(group),
+                       'type': 'choropleth'})
+    return traces
+
+
+# function used in building the frames of the animated cluster map of a batch run, one frame per year with the
+# groups of the year (numbered as in the membership) and the title of the year
+# frames are kept in the clustering cache with the membership, switching the cluster year reuses them
+def cluster_membership_frames(membership, year_data, indicators, title):
+    frames_key = json.dumps(['frames', membership['key']])
+    frames = CLUSTER_CACHE.get(frames_key)
+    if frames is not None:
+        return frames
+    
+    frames = []
+    for year, inertia in zip(membership['years'], membership['inertia']):
+        df_clusters = year_data[year][0].copy()
+        df_clusters['Cluster'] = membership_labels(membership, year, df_clusters['Country Name'])
+        df_clusters.sort_values(by='Cluster', ascending=True, inplace=True)
+        df_clusters['Cluster'] = df_clusters['Cluster'].apply(convert_to_group_name)
+        frames.append({'name': str(year), 
+                       'data': cluster_map_traces(df_clusters, indicators),
+                       'layout': {'title': {'text': title(year, inertia)}}})
+    
+    CLUSTER_CACHE.set(frames_key, frames)
+    return frames
+
+
+# function used in building the year slider and the play / pause buttons of the animated cluster map
+def cluster_map_animation(frames, active_frame):
+    def animate(frame_names, duration):
+        return [frame_names, {'frame': {'duration': duration, 'redraw': True}, 'mode': 'immediate', 
+                              'fromcurrent': True, 'transition': {'duration': 0, 'easing': 'linear'}}]
+    
+    sliders = [{'active': active_frame,
+                'currentvalue': {'prefix': 'Year='},
+                'len': 0.9,
+                'pad': {'b': 10, 't': 10},
+                'steps': [{'args': animate([frame['name']], 0), 'label': frame['name'], 'method': 'animate'} 
+                          for frame in frames],
+                'x': 0.1, 'xanchor': 'left', 'y': 0, 'yanchor': 'top'}]
+    updatemenus = [{'buttons': [{'args': animate(None, 1200), 'label': '&#9654;', 'method': 'animate'},
+                                {'args': animate([None], 0), 'label': '&#9724;', 'method': 'animate'}],
+                    'direction': 'left',
+                    'pad': {'r': 10, 't': 20},
+                    'showactive': False,
+                    'type': 'buttons',
+                    'x': 0.1, 'xanchor': 'right', 'y': 0, 'yanchor': 'top'}]
+    return sliders, updatemenus
+
+
+# function used in drawing the cluster map: the full figure for the first map of a session, afterwards a Patch
+# of the traces, title and indicators annotation on top of the base figure already shown
+# batch runs add the frames of every year with a slider starting at active_frame
+def cluster_map_figure(traces, title, annotation, base_shown=False, frames=None, active_frame=0):
+    sliders, updatemenus = cluster_map_animation(frames, active_frame) if frames else ([], [])
+    
+    if base_shown:
+        patch = Patch()
+        patch['data'] = traces
+        patch['layout']['title']['text'] = title
+        patch['layout']['annotations'][0]['text'] = annotation
+        # the animation of a previous batch run is removed by a single year run
+        patch['layout']['sliders'] = sliders
+        patch['layout']['updatemenus'] = updatemenus
+        patch['frames'] = frames or []
+        return patch
+    
+    layout = json.loads(cluster_map_base())
+    layout['title'] = {'text': title}
+    layout['annotations'][0]['text'] = annotation
+    figure = {'data': traces, 'layout': layout}
+    if frames:
+        layout['sliders'] = sliders
+        layout['updatemenus'] = updatemenus
+        figure['frames'] = frames
+    return figure
+
+
+# function used in answering a clustering request which cannot be run: an empty cluster map with the reason as title,
+# the other outputs of update_cluster_graph are left as they are
+def cluster_map_message(message, base_shown=False):
+    fig = cluster_map_figure([], message, '', base_shown=base_shown)
+    return (fig, no_update, no_update, no_update, no_update, no_update, True)
+
+
+# In[27]:
+
+
+# function used in reading the id of the component whose change fired the running callback,
+# None when the callback is called directly (benchmarks) instead of by dash
+def triggered_id():
+    try:
+        return ctx.triggered_id
+    except MissingCallbackContextException:
+        return None
+
+
+# callback for updating cluster chart
+@app.callback(
+    Output('cluster-chart', 'figure'),
+    Output('cluster-group-dropdown', 'options'),
+    Output('cluster-group-dropdown', 'value'),
+    Output('cluster-group-indicator-dropdown', 'options'),
+    Output('cluster-group-indicator-dropdown', 'value'),
+    Output("stored-cluster-data", "data"),
+    Output('cluster-chart-state', 'data'),
+    Input('submit-cluster-settings-button', 'n_clicks'),
+    State("stored-data", "data"), 
+    State("cluster-indicators-dropdown", "value"),
+    Input("cluster-indicators-year-dropdown", "value"),  # after a batch run, switching years is answered from the cache
+    Input("cluster-number-slider", "value"),  # once the k sweep of a run is done, switching k is answered from the cache
+    State('cluster-all-years-switch', 'value'),
+    State('cluster-chart-state', 'data'),
+    State("stored-cluster-data", "data"),  # year and k changes re-fit the selection and indicators of the last run
+    background=True,  # clustering runs as a background job, web workers stay free for other callbacks
+    interval=500,  # poll the job twice a second, k changes served from the cache return within one poll
+    running=[
+        (Output('submit-cluster-settings-button', 'disabled'), True, False),
+        (Output('cancel-cluster-settings-button', 'disabled'), False, True),
+        (Output('cluster-progress-bar', 'style'), {'display': 'flex', 'margin-top': '10px'}, {'display': 'none'}),
+    ],
+    progress=[Output('cluster-progress-bar', 'value'), Output('cluster-progress-bar', 'label')],
+    cancel=[Input('cancel-cluster-settings-button', 'n_clicks')],
+    prevent_initial_call=True,
+)
+    
+def update_cluster_graph(set_progress, n_clicks, stored_data, indicators, 
+                         cluster_year, n_clusters, all_years=False, cluster_map_shown=None, stored_cluster_data=None):
+    
+    # a year or k change keeps the settings of the last run, indicators, years or batch mode edited since
+    # are only used with the next submit (direct calls without a trigger are handled as a submit)
+    trigger = triggered_id()
+    if trigger in ('cluster-indicators-year-dropdown', 'cluster-number-slider'):
+        run = stored_cluster_data.get('run') if isinstance(stored_cluster_data, dict) else None
+        if not run:
+            raise PreventUpdate
+        stored_data, indicators, all_years = run['selection'], run['indicators'], run['all_years']
+    elif not n_clicks:
+        raise PreventUpdate
+
+    if not indicators or (cluster_year is None and trigger == 'cluster-indicators-year-dropdown'):
+        raise PreventUpdate 
+    if cluster_year is None:
+        return cluster_map_message('Select a cluster year', bool(cluster_map_shown))
+    cluster_year = int(cluster_year)
+    
+    set_progress((10, 'Preparing data...'))
+
+    # extract indicators to be used as dropdown in cluster table
+    indicators_list = selection_catalog(stored_data)['indicators']
+    indicators_options = [{'label': label, 'value': label} for label in indicators_list]
+    indicator_value = indicators[0] # active indicator for table
+
+    # the cluster year has to be a year of the selection with enough countries (with data for every indicator in
+    # batch mode, where the years without are skipped), otherwise the reason is shown on the map
+    start_year, end_year = stored_data['years'] or (CATALOG['years'][0], CATALOG['years'][-1])
+    if not start_year <= cluster_year <= end_year:
+        return cluster_map_message(f'Cluster year {cluster_year} is outside of the selected years '
+                                   f'{start_year}-{end_year}', bool(cluster_map_shown))
+    
+    # years to cluster: the cluster year, or every year of the selection in batch mode
+    years = cluster_years(stored_data, indicators, n_clusters) if all_years else [cluster_year]
+    if (cluster_year not in years or cluster_year not in PANEL.year_index
+            or len(PANEL.year_values(stored_data, cluster_year, indicators)[0]) < n_clusters):
+        return cluster_map_message(f'No data to form {n_clusters} clusters of the selected indicators '
+                                   f'in {cluster_year}', bool(cluster_map_shown))
+
+    set_progress((30, 'Scaling indicators...'))
+
+    # impute missing values with the mean of each column and scale the indicators, year by year
+    # (numpy broadcast of the values of the panel with the precomputed statistics of the selection)
+    year_data = {year: prepare_cluster_data(stored_data, year, indicators) for year in years}
+    filtered_df, scaled_data, (mean, scale) = year_data[cluster_year]
+
+    set_progress((50, 'Clustering countries...'))
+
+    # use k-means clustering on the imputed DataFrame (cached per selection and data)
+    cache_key = cluster_cache_key(stored_data, indicators, cluster_year, n_clusters, scaled_data)
+    kmeans_result = fit_clusters(scaled_data, n_clusters, cache_key)
+    labels, inertia = kmeans_result['labels'], kmeans_result['inertia']
+    centroids = kmeans_result['centroids'] * scale + mean
+    
+    # batch mode: every year is fitted (once per selection) and the groups of the cluster year
+    # are numbered as in the year x country membership
+    if all_years:
+        membership = cluster_membership(stored_data, indicators, n_clusters, year_data,
+                                        progress=lambda i, n: set_progress((60 + 30 * i // n, f'Clustering years ({i + 1}/{n})...')))
+        labels = membership_labels(membership, cluster_year, filtered_df['Country Name'])
+        inertia = membership['inertia'][years.index(cluster_year)]
+        centroids = membership['centroids'][years.index(cluster_year)]
+    
+    df_clusters = filtered_df.copy()
+    df_clusters['Cluster'] = labels
+
+    # sort dataframe by group assignment
+    df_clusters.sort_values(by='Cluster', ascending=True, inplace=True)
+
+    # rename group
+    df_clusters['Cluster'] = df_clusters['Cluster'].apply(convert_to_group_name)
+
+    set_progress((90, 'Drawing map...'))
+
+    # cluster map on the cached base figure, only the cluster traces and titles are built per request
+    def title(year, inertia):
+        return f'Country cluster period - {year}. Number of clusters: {n_clusters}<br>Inertia: {inertia:,.2f}'
+    annotation = 'Selected Cluster Indicators:<br>' + "<br>".join(indicators)
+    
+    # batch mode: the map is animated over the years of the membership, starting at the cluster year
+    frames = cluster_membership_frames(membership, year_data, indicators, title) if all_years else None
+    fig = cluster_map_figure(cluster_map_traces(df_clusters, indicators), title(cluster_year, inertia), annotation, 
+                             base_shown=bool(cluster_map_shown), frames=frames, active_frame=years.index(cluster_year))
 
     # Get all unique entries from the 'label' column
     unique_clusters = df_clusters['Cluster'].unique()
@@ -1407,11 +2411,40 @@ def update_cluster_graph(n_clicks, stored_data, indicators,
     # Set initial selected value if needed
     initial_value = unique_clusters[0]
 
-    merge_cols = ['Country Name', 'Country Code', 'Capital', 'Continent']
-    df_clusters = df_clusters[['Country Name', 'Country Code', 'Capital', 'Continent', 'Cluster']]
-    cluster_data = df_transformed.merge(df_clusters, left_on = merge_cols, right_on = merge_cols)            
+    # the cluster result is stored without the panel: cluster group of every country (in the order of the panel),
+    # centroids in indicator units and the settings of the run, the panel is read from PANEL where needed
+    df_labels = pd.DataFrame({'Country Name': filtered_df['Country Name'].to_numpy(),
+                              'Cluster': [convert_to_group_name(label) for label in labels]})
+    df_centroids = pd.DataFrame(centroids, columns=indicators)
+    df_centroids.insert(0, 'Cluster', [convert_to_group_name(label) for label in range(len(df_centroids))])
+    run = {'selection': stored_data, 'indicators': list(indicators), 'year': cluster_year, 'years': years, 
+           'n_clusters': n_clusters, 'inertia': inertia, 'all_years': bool(all_years)}
+    cluster_data = {'labels': encode_frame(df_labels), 'centroids': encode_frame(df_centroids), 'run': run}
+
+    return fig, options, initial_value, indicators_options, indicator_value, cluster_data, True
+
 
-    return fig, options, initial_value, indicators_options, indicator_value, cluster_data.to_dict('records')
+# callback for the k sweep chart: every k of the slider is fitted for the run in the cluster store, in its own
+# background job after the clustering result is returned, so a submit only waits for the requested k. the fits go
+# through the clustering cache, following slider changes of the run are served from it
+@app.callback(
+    Output('cluster-k-sweep-chart', 'figure'),
+    Output('cluster-k-sweep-chart', 'style'),
+    Input("stored-cluster-data", "data"),
+    background=True,
+    interval=500,
+    prevent_initial_call=True,
+)
+
+def update_k_sweep_chart(stored_cluster_data):
+    if not isinstance(stored_cluster_data, dict) or 'run' not in stored_cluster_data:
+        raise PreventUpdate
+    run = stored_cluster_data['run']
+    
+    _, scaled_data, _ = prepare_cluster_data(run['selection'], run['year'], run['indicators'])
+    sweep = sweep_clusters(run['selection'], run['indicators'], run['year'], scaled_data)
+    
+    return build_k_sweep_figure(sweep, run['n_clusters']), {'display': 'block'}
 
 
 # In[28]:
@@ -1419,34 +2452,86 @@ def update_cluster_graph(n_clicks, stored_data, indicators,
 
 # callback to populate year dropdown menu in cluster analysis section
 
-@app.callback(
+# year options are derived from the slider range in the browser (assets/clientside.js), the cluster year itself
+# is left to the user: it is an input of the clustering, which only re-fits on edits of the year dropdown
+app.clientside_callback(
+    ClientsideFunction(namespace='macro_explorer', function_name='cluster_year_options'),
     Output('cluster-indicators-year-dropdown', 'options'), # in cluster settings setup field
-    Output('cluster-indicators-year-dropdown', 'value'), # in cluster settings setup field
     Output('cluster-group-year-dropdown', 'options'), # in explore table
     Input("data-setup-range-slider", "value"), # in explore table
 )
 
-def update_explore_cluster_year_dropdown(data_range_selected):
-    # this is obtained from the slider range from the data setup section
-    start_year, end_year = data_range_selected
-    
-    start_year = int(start_year)
-    
-    end_year = int(end_year)
-    
-    years_list_options = list(range(start_year, end_year + 1, 1))
+
+# In[29]:
+
+
+# function used in reading the cluster group of every country from the cluster store (a country -> cluster mapping)
+def cluster_labels(stored_cluster_data):
+    if isinstance(stored_cluster_data, dict) and 'labels' in stored_cluster_data:
+        stored_cluster_data = stored_cluster_data['labels']
+    countries = store_column(stored_cluster_data, 'Country Name')
+    if countries is None:
+        countries = pd.Series([], dtype=object)
+    clusters = store_column(stored_cluster_data, 'Cluster')
+    if clusters is None:
+        clusters = pd.Series([None] * len(countries), dtype=object)
+    country_cluster = pd.Series(clusters.to_numpy(), index=pd.Index(countries, name='Country Name'), name='Cluster')
+    # stores of older sessions hold one row per country and year
+    return country_cluster[~country_cluster.index.duplicated()]
+
+
+# function used in reading countries and their cluster group from the cluster store
+def peer_catalog(stored_cluster_data):
+    return {'countries': cluster_labels(stored_cluster_data).index.tolist()}
+
+
+# panels of the clustering runs (selection of the run with the cluster group of every clustered country), keyed by run
+CLUSTER_PANEL_CACHE = LRUCache(maxsize=8)
+
+
+# function used in keying the server-side caches by a clustering run: hash of the selection, indicators, year
+# and cluster group of every country, built on the server from the content the cached entries are built from
+def run_key(stored_cluster_data, country_cluster=None):
+    run = stored_cluster_data['run']
+    if country_cluster is None:
+        country_cluster = cluster_labels(stored_cluster_data)
+    return hashlib.sha1(json.dumps([selection_key(run['selection']), run['indicators'], run['year'],
+                                    country_cluster.index.tolist(), country_cluster.tolist()]).encode()).hexdigest()
+
+
+# function used in reading the panel of a clustering run from the server-side dataset, with the run key
+# the frame is shared by the callbacks through the cache and must not be modified
+def cluster_panel(stored_cluster_data):
+    if not isinstance(stored_cluster_data, dict) or 'run' not in stored_cluster_data:
+        # cluster stores of older sessions hold no run, the panel is available after the next clustering
+        raise PreventUpdate
+    run = stored_cluster_data['run']
+    key = run_key(stored_cluster_data)
     
-    return years_list_options, start_year, years_list_options
+    df_panel = CLUSTER_PANEL_CACHE.get(key)
+    if df_panel is None:
+        # labels are attached with an indexed lookup by country instead of a join on the panel
+        df_panel = PANEL.wide(run['selection'])
+        df_panel['Cluster'] = df_panel['Country Name'].map(cluster_labels(stored_cluster_data))
+        df_panel = df_panel[df_panel['Cluster'].notna()].reset_index(drop=True)
+        CLUSTER_PANEL_CACHE.put(key, df_panel)
+    return df_panel, key
 
 
-# In[29]:
+# rows of the explore tables shared by all workers (keyed by selection, cluster group, indicator, year and cluster data)
+# pages, filters and sorting of a table are answered from here
+TABLE_CACHE = diskcache.Cache(os.path.join(CACHE_DIR, 'tables'), 
+                              eviction_policy='least-recently-used', 
+                              size_limit=64 * 2**20)
+TABLE_CACHE.stats(enable=True)
 
 
 # callback for updating explore table
 
 @app.callback(
-    Output('datatable-container', 'children'),
-    Output('stored-peer-analysis-data', 'data'), # merged cluster and original data
+    Output('datatable-interactivity', 'columns'),
+    Output('datatable-interactivity', 'page_current'),
+    Output('datatable-key', 'data'),
     State("stored-data", "data"),
     Input('cluster-group-dropdown', 'value'),
     Input('cluster-group-indicator-dropdown', 'value'),
@@ -1455,24 +2540,15 @@ def update_explore_cluster_year_dropdown(data_range_selected):
 )
 
 def update_explore_cluster_table(stored_data, cluster_group, selected_table_indicator, stored_cluster_data, selected_year):
-    # transform data frame
-    data_frame = pd.DataFrame(stored_data).copy() # original data source
-    
-    df_stored_cluster = pd.DataFrame(stored_cluster_data)
-    
-    data_frame = data_frame[data_frame['Series Name']==selected_table_indicator]
-    
-    df_transformed = data_frame.pivot_table(index=['Country Name', 'Country Code', 'year', 'Capital','Continent'],
-                                              columns='Series Name', values='value', aggfunc='first').reset_index()   
-    
-    merge_columns = ['Country Name', 'year']
-    df_updated = df_transformed.merge(df_stored_cluster, how='left', 
-                                      left_on=merge_columns, right_on=merge_columns, suffixes=('', '_right'))
-    
-    # Drop columns ending with '_right'
-    columns_to_drop = [col for col in df_updated.columns if col.endswith('_right')]
-    df_updated = df_updated.drop(columns=columns_to_drop)
+    if not isinstance(stored_data, dict) or not isinstance(selected_table_indicator, str):
+        raise PreventUpdate
     
+    country_cluster = cluster_labels(stored_cluster_data)
+
+    # wide data frame of the selected indicator from the pre-pivoted panel, labelled by country
+    df_updated = PANEL.wide(stored_data, [selected_table_indicator])
+    df_updated['Cluster'] = df_updated['Country Name'].map(country_cluster)
+
     df_filter= df_updated[df_updated['Cluster'] == cluster_group]
     
     if selected_year is not None:
@@ -1482,49 +2558,108 @@ def update_explore_cluster_table(stored_data, cluster_group, selected_table_indi
     df_filter[selected_table_indicator] = df_filter[selected_table_indicator].round(1)
     df_filter = df_filter[['Country Name', 'year', 'Cluster', 'Capital', 'Continent', selected_table_indicator]]
     
-    table_layout = dash_table.DataTable(
-        id='datatable-interactivity',
-        columns=[
-            {"name": i, "id": i, "deletable": False, "selectable": True, "hideable": False}
-            if i == "Country Name" or i == "year" 
-            else {"name": i, "id": i, "deletable": True, "selectable": True, "hideable": True}
-            for i in df_filter.columns
-        ],
-        
-        data=df_filter.to_dict('records'),  # the contents of the table
-        editable=True,              # allow editing of data inside all cells
-        filter_action="native",     # allow filtering of data by user ('native') or not ('none')
-        sort_action="native",       # enables data to be sorted per-column by user or not ('none')
-        sort_mode="single",         # sort across 'multi' or 'single' columns
-        column_selectable="multi",  # allow users to select 'multi' or 'single' columns
-        row_selectable="multi",     # allow users to select 'multi' or 'single' rows
-        row_deletable=True,         # choose if user can delete a row (True) or not (False)
-        selected_columns=[],        # ids of columns that user selects
-        selected_rows=[],           # indices of rows that user selects
-        page_action="native",       # all data is passed to the table up-front or not ('none')
-        page_current=0,             # page number that user is on
-        page_size=10,               # number of rows visible per page
-        style_cell={                # ensure adequate header width when text is shorter than cell's text
-            'minWidth': 95, 'maxWidth': 95, 'width': 95
-        },
-        style_cell_conditional=[    # align text columns to left. By default they are aligned to right
-            {'if': {'column_id': c},
-                'textAlign': 'left'
-            } for c in ['Country Name', 'Country Code']
-        ],
-        
-        style_data={                # overflow cells' content into multiple lines
-            'whiteSpace': 'normal',
-            'height': 'auto'
-        },
+    # the rows stay on the server, the table requests its pages (update_explore_table_page)
+    table_key = hashlib.sha1(json.dumps([selection_key(stored_data), cluster_group, selected_table_indicator, selected_year, 
+                                         country_cluster.to_dict()], default=str).encode()).hexdigest()
+    TABLE_CACHE.set(table_key, df_filter.reset_index(drop=True))
+    
+    columns = [
+        {"name": i, "id": i, "deletable": False, "selectable": True, "hideable": False}
+        if i == "Country Name" or i == "year" 
+        else {"name": i, "id": i, "deletable": True, "selectable": True, "hideable": True}
+        for i in df_filter.columns
+    ]
+    
+    return columns, 0, table_key
+
+
+# operators of the datatable filter query, in the order they are matched (two character operators first)
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='], 
+                    ['contains '], ['datestartswith ']]
+
+
+# function used in splitting one part of a filter query ('{year} > 2005') into column, operator and value
+# the {column} is read first, column names may contain operators themselves ('{Consumer price index (2010 = 100)} = 100')
+def split_filter_part(filter_part):
+    filter_part = filter_part.strip()
+    if filter_part.startswith('{') and '}' in filter_part:
+        name, operator_part = filter_part[1:].split('}', 1)
+    else:
+        name, _, operator_part = filter_part.partition(' ')
+    operator_part = operator_part.lstrip()
+    
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator_part.startswith(operator):
+                value_part = operator_part[len(operator):].strip()
+                first_character = value_part[:1]
+                if first_character and first_character == value_part[-1] and first_character in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + first_character, first_character)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                
+                return name, operator_type[0].strip(), value
+
+    return [None] * 3
+
+
+# function used in applying a filter query and the sort order of the table to its rows
+def filter_sort_table(df_table, filter_query, sort_by):
+    
+    for filter_part in (filter_query or '').split(' && '):
+        column, operator, value = split_filter_part(filter_part)
+        if column not in df_table.columns:
+            continue
         
-        style_table={
-                    'overflowX': 'auto',  # Enable horizontal scrolling if needed
-                    'height': '400px',    # Set the desired height of the table
-                    'width': '100%',      # Set the width of the table to 100% of the container
-                },
-    )
-    return [table_layout], df_updated.to_dict('records')
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            # comparisons of text with numbers (or numbers with text) match no row
+            try:
+                mask = getattr(df_table[column], operator)(value)
+            except TypeError:
+                mask = pd.Series(operator == 'ne', index=df_table.index)
+            df_table = df_table.loc[mask]
+        elif operator == 'contains':
+            df_table = df_table.loc[df_table[column].astype(str).str.contains(str(value), regex=False)]
+        elif operator == 'datestartswith':
+            df_table = df_table.loc[df_table[column].astype(str).str.startswith(str(value))]
+    
+    if sort_by:
+        df_table = df_table.sort_values([col['column_id'] for col in sort_by],
+                                        ascending=[col['direction'] == 'asc' for col in sort_by],
+                                        kind='stable')
+    return df_table
+
+
+# callback for the page of the explore table, only the visible rows are sent
+@app.callback(
+    Output('datatable-interactivity', 'data'),
+    Output('datatable-interactivity', 'page_count'),
+    Output('datatable-interactivity', 'page_current', allow_duplicate=True),
+    Input('datatable-key', 'data'),
+    Input('datatable-interactivity', 'page_current'),
+    Input('datatable-interactivity', 'page_size'),
+    Input('datatable-interactivity', 'sort_by'),
+    Input('datatable-interactivity', 'filter_query'),
+    prevent_initial_call='initial_duplicate',
+)
+
+def update_explore_table_page(table_key, page_current, page_size, sort_by, filter_query):
+    
+    df_table = TABLE_CACHE.get(table_key) if table_key is not None else None
+    if df_table is None:
+        raise PreventUpdate
+    
+    df_table = filter_sort_table(df_table, filter_query, sort_by)
+    
+    # a filter can leave fewer pages than the current page number, the table moves to the last page left
+    page_count = max(1, -(-len(df_table) // page_size))
+    page_shown = min(page_current or 0, page_count - 1)
+    page = df_table.iloc[page_shown * page_size: (page_shown + 1) * page_size]
+    
+    return page.to_dict('records'), page_count, page_shown if page_shown != page_current else no_update
 
 
 # In[30]:
@@ -1532,15 +2667,48 @@ def update_explore_cluster_table(stored_data, cluster_group, selected_table_indi
 
 # callback for downloading cluster data
 
+# above this number of cells the excel export is written row by row in constant memory mode
+EXCEL_CONSTANT_MEMORY_CELLS = 200_000
+
+
+# function used in writing data frames to excel sheets, in constant memory mode rows are flushed to the file as they are written
+def write_excel(buffer, dict_df_download, constant_memory=False):
+    
+    if not constant_memory:
+        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+            for df_name, df in dict_df_download.items():
+                df.to_excel(writer, sheet_name=df_name, index=False)
+        return
+    
+    workbook = xlsxwriter.Workbook(buffer, {'constant_memory': True, 'nan_inf_to_errors': True})
+    for df_name, df in dict_df_download.items():
+        worksheet = workbook.add_worksheet(df_name)
+        worksheet.write_row(0, 0, [str(col) for col in df.columns])
+        for row_number, row in enumerate(df.astype(object).where(df.notna(), None).itertuples(index=False), start=1):
+            worksheet.write_row(row_number, 0, row)
+    workbook.close()
+
+
+# function used in writing each data frame to a csv or parquet file inside a zip archive
+def write_zip(buffer, dict_df_download, file_format):
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for df_name, df in dict_df_download.items():
+            if file_format == 'parquet':
+                archive.writestr(f'{df_name}.parquet', df.to_parquet(index=False))
+            else:
+                archive.writestr(f'{df_name}.csv', df.to_csv(index=False))
+
+
 @app.callback(
     Output('download-cluster-dataset-component', 'data'),
-    State('stored-peer-analysis-data', 'data'),
+    State('stored-cluster-data', 'data'),
     State("cluster-indicators-dropdown", "value"),
+    State('download-cluster-format-dropdown', 'value'),
     Input('download-cluster-analysis-button', 'n_clicks'),
     prevent_initial_call = True,
 )
 
-def download_cluster_analysis(stored_cluster_data, slected_cluster_indicators, n_clicks):
+def download_cluster_analysis(stored_cluster_data, slected_cluster_indicators, file_format, n_clicks):
     
     if not n_clicks:
         
@@ -1549,23 +2717,19 @@ def download_cluster_analysis(stored_cluster_data, slected_cluster_indicators, n
     # Create a new data frame with selected indicators
     df_selected_indicators = pd.DataFrame({'Indicators': slected_cluster_indicators})
     
-    df_final = pd.DataFrame(stored_cluster_data) # original data source
+    df_final, _ = cluster_panel(stored_cluster_data) # panel of the clustering run
     
     dict_df_download = {'Indicators':df_selected_indicators, 'ClusterData': df_final}
     
-    writer = pd.ExcelWriter("cluster_analysis_export.xlsx", engine='xlsxwriter')
+    # the file is built in memory and sent directly, nothing is written to the working directory
+    if file_format in ('csv', 'parquet'):
+        return dcc.send_bytes(lambda buffer: write_zip(buffer, dict_df_download, file_format), 
+                              f'cluster_analysis_export_{file_format}.zip')
     
-    workbook = writer.book  
+    constant_memory = df_final.size > EXCEL_CONSTANT_MEMORY_CELLS
     
-    for df_name , df in dict_df_download.items():
-        
-        df.to_excel(writer, sheet_name=df_name, index=False)
-        
-        worksheet = writer.sheets[df_name]
-
-    writer.save()
-            
-    return dcc.send_file("cluster_analysis_export.xlsx")   
+    return dcc.send_bytes(lambda buffer: write_excel(buffer, dict_df_download, constant_memory), 
+                          'cluster_analysis_export.xlsx')
 
 
 # In[ ]:
@@ -1579,15 +2743,13 @@ def download_cluster_analysis(stored_cluster_data, slected_cluster_indicators, n
 # In[31]:
 
 
-@app.callback(
+# toggle collapse in the browser (assets/clientside.js), no request to the server
+app.clientside_callback(
+    ClientsideFunction(namespace='macro_explorer', function_name='toggle_collapse'),
     Output("peer-analysis-collapse", "is_open"),
     [Input("peer-analysis-collapse-button", "n_clicks")],
     [State("peer-analysis-collapse", "is_open")],
 )
-def toggle_peer_analysis_collapse(n, is_open):
-    if n:
-        return not is_open
-    return is_open
 
 
 # In[32]:
@@ -1597,15 +2759,13 @@ def toggle_peer_analysis_collapse(n, is_open):
 
 @app.callback(
     Output('country-focus-peer-analysis-dropdown', 'options'),
-    Input("stored-peer-analysis-data", "data"),
+    Input("stored-cluster-data", "data"),
 )
 
-def update_country_focus_dropdown(stored_peer_data):
-    
-    df_stored_peer_data = pd.DataFrame(stored_peer_data)
+def update_country_focus_dropdown(stored_cluster_data):
     
     # Get all unique ectries
-    country_list = df_stored_peer_data['Country Name'].unique().tolist()
+    country_list = peer_catalog(stored_cluster_data)['countries']
     
     # Create options for the Dropdown
     options = [{'label': label, 'value': label} for label in country_list]
@@ -1618,29 +2778,33 @@ def update_country_focus_dropdown(stored_peer_data):
 
 # update custom benchmark multiple dropdown list
 
-@app.callback(
+# Disable the dropdown if 'disable' radio button is selected, otherwise enable (in the browser, assets/clientside.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='macro_explorer', function_name='custom_dropdown_disabled'),
     Output('custom-benchmark-dropdown', 'disabled'),
+    Input('benchmark-selected-radio', 'value'),
+)
+
+
+@app.callback(
     Output('custom-benchmark-dropdown', 'options'),
     Input('benchmark-selected-radio', 'value'),
-    Input('stored-peer-analysis-data', 'data')
+    Input('stored-cluster-data', 'data')
 )
 
-def update_custom_dropdown_state(selected_radio_value, stored_peer_data):
-    # Disable the dropdown if 'disable' radio button is selected, otherwise enable
+def update_custom_dropdown_state(selected_radio_value, stored_cluster_data):
     
     if selected_radio_value == "cluster-benchmark":
-        return selected_radio_value == 'cluster-benchmark', []
+        return []
     
     else:
-        df_stored_peer_data = pd.DataFrame(stored_peer_data)
-        
-        # Get all unique entries from the 'label' column
-        unique_countries = df_stored_peer_data['Country Name'].unique()
+        # Get all unique countries of the peer data
+        unique_countries = peer_catalog(stored_cluster_data)['countries']
 
         # Create options for the exploring cluster groups Dropdown
         options = [{'label': label, 'value': label} for label in unique_countries]
         
-        return False, options
+        return options
 
 
 # In[34]:
@@ -1655,10 +2819,8 @@ def update_custom_dropdown_state(selected_radio_value, stored_peer_data):
 
 def update_peer_indicator_list_dropdown(stored_data):
 
-    df_stored_data = pd.DataFrame(stored_data)
-
-    # Get all unique entries from the 'label' column
-    unique_indicators = df_stored_data['Series Name'].unique()
+    # Get the indicators of the stored selection from the catalog
+    unique_indicators = selection_catalog(stored_data)['indicators']
 
     # Create options for the exploring cluster groups Dropdown
     options = [{'label': label, 'value': label} for label in unique_indicators]
@@ -1669,33 +2831,114 @@ def update_peer_indicator_list_dropdown(stored_data):
 # In[35]:
 
 
+# function used in building a trace of the peer comparison line chart as px.line builds it in update_peer_graph
+def peer_line_trace(df_country, country, indicator, selected_country, color, trace_type):
+    trace = {'hovertemplate': f'Country Name={country}<br>year=%{{x}}<br>{indicator}=%{{y}}<extra></extra>',
+             'legendgroup': country,
+             'line': {'color': color, 'dash': 'dashdot' if country == selected_country else 'solid', 'width': 2},
+             'marker': {'symbol': 'circle'},
+             'mode': 'lines+markers',
+             'name': country,
+             'showlegend': True,
+             'x': df_country['year'].tolist(),
+             'xaxis': 'x',
+             'y': df_country[indicator].tolist(),
+             'yaxis': 'y',
+             'type': trace_type}
+    
+    # svg traces carry an orientation, webgl traces do not
+    if trace_type == 'scatter':
+        trace['orientation'] = 'v'
+    return trace
+
+
+# function used in updating the peer comparison chart in place: traces of removed countries are deleted, traces of
+# added countries inserted and the y data swapped on an indicator change, the figure itself is not resent
+def patch_peer_graph(previous_state, state, df_filter, indicator, selected_country):
+    
+    patch = Patch()
+    previous_countries = previous_state['countries']
+    countries = state['countries']
+    indicator_changed = previous_state['indicator'] != indicator
+    
+    if indicator_changed:
+        patch['layout']['title']['text'] = f'Peer comparison for {selected_country} based on {indicator}'
+        patch['layout']['yaxis']['title']['text'] = indicator
+    
+    if state['graph_type'] != 'line':
+        if previous_countries != countries:
+            patch['data'][0]['x'] = df_filter['year'].tolist()
+            patch['data'][0]['y'] = df_filter['Country Name'].tolist()
+        if previous_countries != countries or indicator_changed:
+            patch['data'][0]['z'] = df_filter[indicator].tolist()
+        if indicator_changed:
+            patch['data'][0]['colorbar']['title']['text'] = indicator
+        return patch
+    
+    # plotly express colors the traces in order of appearance with the D3 sequence of the 'gridon' template
+    colors = analytics_modules().px.colors.qualitative.D3
+    
+    # countries are in the order of the store in both lists, the remaining traces keep their relative order
+    for position in reversed(range(len(previous_countries))):
+        if previous_countries[position] not in countries:
+            del patch['data'][position]
+    
+    kept_countries = set(previous_countries) & set(countries)
+    country_frames = dict(tuple(df_filter.groupby('Country Name', sort=False)))
+    
+    for position, country in enumerate(countries):
+        color = colors[position % len(colors)]
+        
+        if country not in kept_countries:
+            patch['data'].insert(position, peer_line_trace(country_frames[country], country, indicator, selected_country,
+                                                           color, state['trace_type']))
+            continue
+        
+        if indicator_changed:
+            patch['data'][position]['y'] = country_frames[country][indicator].tolist()
+            patch['data'][position]['hovertemplate'] = (f'Country Name={country}<br>year=%{{x}}<br>{indicator}=%{{y}}'
+                                                        '<extra></extra>')
+        
+        previous_color = colors[previous_countries.index(country) % len(colors)]
+        if previous_color != color:
+            patch['data'][position]['line']['color'] = color
+            
+    return patch
+
+
 # update peer comparison chart (server-side callback)
 
 @app.callback(
     Output('peer-comparison-chart', 'figure'),
+    Output('peer-comparison-chart-state', 'data'),
     Input('peer-settings-submit-button', 'n_clicks'),
-    State('stored-peer-analysis-data', 'data'),
+    State('stored-cluster-data', 'data'),
     State('country-focus-peer-analysis-dropdown', 'value'),
     State('benchmark-selected-radio', 'value'),
     Input('custom-benchmark-dropdown', 'value'),
     Input('peer-comparison-indicator-dropdown', 'value'),
     Input('peer-analysis-graph-type-dropdown', 'value'),
+    State('peer-comparison-chart-state', 'data'),
     
     prevent_initial_call=True,  
 )
 
 def update_peer_graph (n_clicks, 
-                       stored_peer_data, 
+                       stored_cluster_data, 
                        selected_country, 
                        selected_benchmark, 
                        selected_custom_benchmark,
                        indicator,
-                       selected_graph_type):   
+                       selected_graph_type,
+                       previous_state=None):   
     if not n_clicks:
         raise PreventUpdate
         
     else:
-        df = pd.DataFrame(stored_peer_data)
+        px = analytics_modules().px
+        
+        # panel of the clustering run, read from the server-side dataset
+        df, run_key = cluster_panel(stored_cluster_data)
         
         if selected_benchmark == "cluster-benchmark":
             
@@ -1714,6 +2957,22 @@ def update_peer_graph (n_clicks,
             
         df_filter = df_country_filter.copy()
         
+        # what the chart shows, a change of countries or indicator alone is sent as a patch of the current figure
+        state = {'n_clicks': n_clicks,
+                 'peer_data': run_key,
+                 'country': selected_country,
+                 'benchmark': selected_benchmark,
+                 'graph_type': selected_graph_type,
+                 'indicator': indicator,
+                 'countries': df_filter['Country Name'].unique().tolist(),
+                 # px.line switches to webgl traces above 1000 points
+                 'trace_type': 'scattergl' if len(df_filter) > 1000 else 'scatter'}
+        
+        patchable = ['n_clicks', 'peer_data', 'country', 'benchmark', 'graph_type', 'trace_type']
+        if (isinstance(previous_state, dict) and state['countries']
+                and all(previous_state.get(field) == state[field] for field in patchable)):
+            return patch_peer_graph(previous_state, state, df_filter, indicator, selected_country), state
+        
         if selected_graph_type == 'line':   
         
             fig = px.line(df_filter, 
@@ -1744,7 +3003,7 @@ def update_peer_graph (n_clicks,
             
             fig.layout.paper_bgcolor = '#E5ECF6'
             
-            return fig
+            return fig, state
         else:
         
             fig = go.Figure(data=go.Heatmap(
@@ -1785,54 +3044,40 @@ def update_peer_graph (n_clicks,
             template='seaborn',  # Set the template: seaborn, plotly_dark, ggplot2, plotly
         )
         
-    return fig
+    return fig, state
 
 
 # In[36]:
 
 
-# update peer comparison choropleth chart (server-side callback)
+# base figures of the peer map per clustering run, one location per country by ISO-3 code: a request only
+# sends the border width (z) of the highlighted countries
+PEER_MAP_CACHE = LRUCache(maxsize=16)
 
-@app.callback(
-    Output('peer-analysis-location-chart', 'figure'),
-    Input('country-focus-peer-analysis-dropdown', 'value'),
-    Input('benchmark-selected-radio', 'value'),
-    Input('stored-peer-analysis-data', 'data'),
-    Input('custom-benchmark-dropdown', 'value'),
-    Input('peer-comparison-indicator-dropdown', 'value'),
-)
-def update_peer_choropleth_graph(selected_country, selected_radio_value, 
-                                 stored_peer_data, selected_custom_benchmark, indicator):
-    
-    df = pd.DataFrame(stored_peer_data)
 
-    df_filter = df.copy()
-    
-    cluster_group = df[df['Country Name']==selected_country]['Cluster'].tolist()[0]
-            
-    cluster_countries = df[df['Cluster']==cluster_group]['Country Name'].unique().tolist()
+# function used in building (or getting from the cache) the base figure of the peer map of some countries as json
+def peer_map_base(countries, peer_key):
     
-    # Initialize selected_countries as an empty list
-    selected_countries = []
+    base_json = PEER_MAP_CACHE.get(peer_key)
+    if base_json is not None:
+        return base_json
     
-    if selected_radio_value == 'cluster-benchmark':
-        selected_countries.extend(cluster_countries)
-    else:
-        selected_countries.extend(selected_custom_benchmark)
-        selected_countries.extend([selected_country])
+    px = analytics_modules().px
+    df = PANEL.country_info.set_index('Country Name').loc[countries, ['Country Code']].reset_index()
     
-    # Create a column to store border width
-    df_filter['border_width'] = df_filter['Country Name'].apply(lambda country: 7 if country in selected_countries else 1)
-
     fig = px.choropleth(
-        df_filter,
-        locations='Country Name',
-        locationmode='country names',
+        df.assign(border_width=1),
+        locations='Country Code',
+        locationmode='ISO-3',
         template='plotly',
         color='border_width',  # Use border_width as a color scale
         color_continuous_scale='Viridis',  # Customize the color scale
         projection='robinson',  # Set the projection type
     )
+    
+    # countries are located by code, the hover keeps showing their names
+    fig.update_traces(hovertext=df['Country Name'], 
+                      hovertemplate='Country Name=%{hovertext}<br>border_width=%{z}<extra></extra>')
 
     fig.update_geos(
         bgcolor='#E5ECF6',
@@ -1852,8 +3097,54 @@ def update_peer_choropleth_graph(selected_country, selected_radio_value,
     )
     
     fig.update_layout(margin=dict(l=10, r=10, t=10, b=10))  # Update margins
+    
+    base_json = fig.to_json()
+    PEER_MAP_CACHE.put(peer_key, base_json)
+    return base_json
 
-    return fig
+
+# update peer comparison choropleth chart (server-side callback)
+
+@app.callback(
+    Output('peer-analysis-location-chart', 'figure'),
+    Output('peer-analysis-location-chart-state', 'data'),
+    Input('country-focus-peer-analysis-dropdown', 'value'),
+    Input('benchmark-selected-radio', 'value'),
+    Input('stored-cluster-data', 'data'),
+    Input('custom-benchmark-dropdown', 'value'),
+    Input('peer-comparison-indicator-dropdown', 'value'),
+    State('peer-analysis-location-chart-state', 'data'),
+)
+def update_peer_choropleth_graph(selected_country, selected_radio_value, 
+                                 stored_cluster_data, selected_custom_benchmark, indicator, shown_peer_key=None):
+    
+    if not isinstance(stored_cluster_data, dict) or 'run' not in stored_cluster_data:
+        raise PreventUpdate
+    
+    # the map has one location per clustered country (sorted by name as in the panel of the run),
+    # with the cluster group of every country from the cluster store
+    country_cluster = cluster_labels(stored_cluster_data)
+    peer_key = run_key(stored_cluster_data, country_cluster)
+    
+    if selected_radio_value == 'cluster-benchmark':
+        cluster_group = country_cluster[selected_country]
+        selected_countries = country_cluster.index[country_cluster.to_numpy() == cluster_group]
+    else:
+        selected_countries = list(selected_custom_benchmark or []) + [selected_country]
+    
+    # border width: 7 for the selected countries, 1 for the others
+    border_width = np.where(country_cluster.index.isin(selected_countries), 7, 1).tolist()
+    
+    # the map of this clustering run is already shown: only the border widths are sent
+    if shown_peer_key == peer_key:
+        fig = Patch()
+        fig['data'][0]['z'] = border_width
+        return fig, peer_key
+
+    fig = json.loads(peer_map_base(country_cluster.index, peer_key))
+    fig['data'][0]['z'] = border_width
+
+    return fig, peer_key
 
 
 # In[ ]:
@@ -1886,10 +3177,63 @@ def download_resume(n_clicks):
 
 
 
+# ##### 4.5 metrics endpoint for the server-side caches
+
+# In[ ]:
+
+
+# function used in reporting hits and misses of a disk cache (clustering or tables, shared by all worker processes)
+def disk_cache_stats(cache):
+    hits, misses = cache.stats()
+    requests = hits + misses
+    return {'size': len(cache),
+            'volume_bytes': cache.volume(),
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / requests if requests else None}
+
+
+# cache statistics as json, the in-memory caches are reported for the worker process answering the request
+@server.route('/metrics')
+def metrics():
+    return jsonify({'pid': os.getpid(),
+                    'figure_cache': FIGURE_CACHE.stats(),
+                    'cluster_cache': disk_cache_stats(CLUSTER_CACHE),
+                    'table_cache': disk_cache_stats(TABLE_CACHE)})
+
+
+# In[ ]:
+
+
+
+
+
+# In[ ]:
+
+
+
+
+
+# ##### 4.6 hooks for serving the app with preloaded, forked gunicorn workers (see gunicorn.conf.py)
+
 # In[ ]:
 
 
+# function called in the gunicorn master before forking the workers: the dataset and its indexes are 
+# already loaded at import, this also loads the deferred analytics packages and moves everything loaded 
+# so far out of reach of the garbage collector, so that the memory pages stay shared by the workers
+def preload():
+    analytics_modules()
+    gc.collect()
+    gc.freeze()
+
 
+# function called in each worker after the fork: sqlite connections of the disk caches must not be shared 
+# between processes, they are reopened on first use
+def after_fork():
+    CLUSTER_CACHE.close()
+    TABLE_CACHE.close()
+    background_callback_manager.handle.close()
 
 
 # ### step 5: run app